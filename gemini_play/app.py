@@ -1,10 +1,18 @@
 # FastAPI Risk Assessment Service
 
+import asyncio
 import logging
+import logging.handlers
+import queue
+import time
+import orjson
+import google.generativeai as genai
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
-from typing import Dict, Any
+from pydantic import BaseModel
+from typing import Dict, Any, List, Optional
 import uvicorn
 from dotenv import load_dotenv
 
@@ -14,40 +22,173 @@ load_dotenv()
 from models import AssessmentRequest, RiskAssessmentResult, ProposalSchema
 from risk_engine import RiskAssessmentEngine
 from db_service import DatabaseServiceClient
-from llm_service import GeminiLLMService
+from llm_service import get_llm_service
+from cache import fingerprint
 import config
 
-# Configure logging
+# Configure logging: request handlers only enqueue records, and a
+# background listener thread formats and writes them
+log_queue = queue.Queue(-1)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+
 logging.basicConfig(
     level=getattr(logging, config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(message)s',  # Full formatting happens in log_handler
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
-# Global engine instance
+# Global engine instance (one per worker process)
 risk_engine = None
 
+async def batch_worker(queue: asyncio.Queue, pending: set):
+    """
+    Coalesce queued assessments into micro-batches
+    
+    Waits for the first queued proposal, then keeps draining the queue until
+    BATCH_MAX_SIZE proposals are collected or BATCH_MAX_DELAY elapses. Each
+    batch is dispatched without blocking collection of the next one; its
+    task is kept in pending until it finishes.
+    """
+    loop = asyncio.get_running_loop()
+    
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + config.BATCH_MAX_DELAY
+        
+        while len(batch) < config.BATCH_MAX_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        task = asyncio.create_task(run_batch(batch))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+async def run_batch(batch):
+    """Assess a batch and route each result back to its waiting request"""
+    proposals = [proposal for proposal, _, _, _ in batch]
+    cfps = [cfp for _, cfp, _, _ in batch]
+    use_cache = [cache_flag for _, _, cache_flag, _ in batch]
+    
+    try:
+        results = await risk_engine.assess_proposals_batch(proposals, cfps, use_cache)
+    except Exception as e:
+        logger.error(f"Batch assessment failed: {e}")
+        for _, _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    
+    for (_, _, _, future), result in zip(batch, results):
+        if not future.done():
+            future.set_result(result)
+
+async def stop_batching():
+    """Cancel the batch worker and running batches, failing assessments left waiting"""
+    tasks = [app.state.batch_worker, *app.state.batch_tasks]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    
+    # Queued or cancelled mid-batch; either way no result is coming
+    error = RuntimeError("Service is shutting down")
+    for future in list(app.state.inflight.values()):
+        if not future.done():
+            future.set_exception(error)
+
+async def submit_assessment(proposal: ProposalSchema, cfp: Optional[Dict[str, Any]] = None,
+                            use_cache: bool = True) -> RiskAssessmentResult:
+    """
+    Queue a proposal for batched assessment and wait for its result
+    
+    Identical proposals already in flight share a single assessment
+    instead of each triggering its own LLM calls.
+    """
+    key = fingerprint([proposal.model_dump_json(), cfp, use_cache])
+    inflight = app.state.inflight
+    
+    if key in inflight:
+        logger.info("Joining in-flight assessment for identical proposal")
+        # Shield so one caller disconnecting doesn't cancel it for the others
+        return await asyncio.shield(inflight[key])
+    
+    future = asyncio.get_running_loop().create_future()
+    inflight[key] = future
+    future.add_done_callback(lambda _: inflight.pop(key, None))
+    
+    await app.state.assessment_queue.put((proposal, cfp, use_cache, future))
+    return await asyncio.shield(future)
+
+def fetch_models() -> List[Dict[str, str]]:
+    """List Gemini models that support content generation"""
+    models = []
+    for model in genai.list_models():
+        if 'generateContent' in model.supported_generation_methods:
+            models.append({
+                "name": model.name,
+                "display_name": model.display_name,
+                "description": model.description
+            })
+    return models
+
+async def refresh_models():
+    """Refresh the cached model list off the event loop"""
+    app.state.models = await asyncio.to_thread(fetch_models)
+    app.state.models_fetched_at = time.monotonic()
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Encode an engine event as a Server-Sent Events message"""
+    payload = {
+        key: value.model_dump(mode="json") if isinstance(value, BaseModel) else value
+        for key, value in event.items()
+    }
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan management"""
     global risk_engine
     
     # Startup
+    log_listener.start()
     logger.info("Starting Risk Assessment Service")
     
     try:
         # Initialize services
         db_client = DatabaseServiceClient()
-        llm_service = GeminiLLMService()
+        llm_service = get_llm_service()
         risk_engine = RiskAssessmentEngine(db_client, llm_service)
         
         # Health check
-        health_status = risk_engine.health_check()
+        health_status = await risk_engine.health_check()
         logger.info(f"Service health: {health_status}")
         
         if not all(health_status.values()):
             logger.warning("Some services are not healthy")
         
+        # Cache the model list; it changes rarely
+        app.state.models = []
+        app.state.models_fetched_at = None
+        try:
+            await refresh_models()
+        except Exception as e:
+            logger.warning(f"Failed to cache model list: {e}")
+        
+        # Start batching worker
+        app.state.inflight = {}
+        app.state.assessment_queue = asyncio.Queue()
+        app.state.batch_tasks = set()
+        app.state.batch_worker = asyncio.create_task(
+            batch_worker(app.state.assessment_queue, app.state.batch_tasks)
+        )
+        
         logger.info("Risk Assessment Service started successfully")
         
     except Exception as e:
@@ -58,13 +199,18 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down Risk Assessment Service")
+    # Batches still use the engine's clients, so stop them before closing it
+    await stop_batching()
+    await risk_engine.aclose()
+    log_listener.stop()
 
 # Create FastAPI app
 app = FastAPI(
     title="Risk Assessment Service",
     description="AI/ML Proposal Risk Assessment Microservice",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -82,14 +228,19 @@ def get_risk_engine() -> RiskAssessmentEngine:
         raise HTTPException(status_code=503, detail="Service not initialized")
     return risk_engine
 
+@app.get("/api/health/live")
+async def liveness_check():
+    """Liveness endpoint; answers without touching the database service or Gemini"""
+    return {"status": "alive", "service": config.SERVICE_NAME, "version": "1.0.0"}
+
 @app.get("/api/health")
 async def health_check():
-    """Health check endpoint"""
+    """Readiness endpoint; dependency results are cached for HEALTH_CHECK_TTL"""
     try:
         if risk_engine is None:
             return {"status": "unhealthy", "message": "Service not initialized"}
         
-        health_status = risk_engine.health_check()
+        health_status = await risk_engine.health_check()
         
         if all(health_status.values()):
             return {
@@ -124,7 +275,8 @@ async def assess_risks(
         "technical_approach": "Technical approach",
         ...
       },
-      "cfp": {...}  // optional context
+      "cfp": {...},  // optional context
+      "no_cache": false  // optional, bypass the response cache
     }
     
     Response:
@@ -147,15 +299,8 @@ async def assess_risks(
     try:
         logger.info(f"Received assessment request for proposal: {request.proposal.proposal_title or 'Untitled'}")
         
-        # Convert proposal to dict for processing
-        proposal_dict = request.proposal.dict()
-        
-        # Add CFP context if provided
-        if request.cfp:
-            proposal_dict["cfp_context"] = request.cfp
-        
         # Perform assessment
-        result = engine.assess_proposal(proposal_dict)
+        result = await submit_assessment(request.proposal, request.cfp, use_cache=not request.no_cache)
         
         logger.info(f"Assessment completed: {result.assessment_id}")
         return result
@@ -164,6 +309,34 @@ async def assess_risks(
         logger.error(f"Assessment failed: {e}")
         raise HTTPException(status_code=500, detail=f"Assessment failed: {str(e)}")
 
+@app.post("/api/v1/assess-risks/stream")
+async def assess_risks_stream(
+    request: AssessmentRequest,
+    engine: RiskAssessmentEngine = Depends(get_risk_engine)
+):
+    """
+    Analyze proposal and stream progress as Server-Sent Events
+    
+    Takes the same request body as /api/v1/assess-risks. Each stage emits
+    one event as it completes:
+    
+    data: {"event": "keywords", "keywords": [...], "confidence": 0.85}
+    data: {"event": "candidates", "count": 24}
+    data: {"event": "risk", "risk": {...}}  // one per assessed risk, as Gemini ranks it
+    data: {"event": "result", "result": {...}, "cached": false}
+    
+    An "error" event precedes the result if the assessment failed.
+    """
+    logger.info(f"Received streaming assessment request for proposal: {request.proposal.proposal_title or 'Untitled'}")
+    
+    async def event_stream():
+        async for event in engine.assess_proposal_stream(
+            request.proposal, request.cfp, use_cache=not request.no_cache
+        ):
+            yield format_sse(event)
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/api/v1/assess-risks-simple", response_model=RiskAssessmentResult)
 async def assess_risks_simple(
     proposal: ProposalSchema,
@@ -175,11 +348,8 @@ async def assess_risks_simple(
     try:
         logger.info(f"Received simple assessment request for proposal: {proposal.proposal_title or 'Untitled'}")
         
-        # Convert proposal to dict for processing
-        proposal_dict = proposal.dict()
-        
         # Perform assessment
-        result = engine.assess_proposal(proposal_dict)
+        result = await submit_assessment(proposal)
         
         logger.info(f"Simple assessment completed: {result.assessment_id}")
         return result
@@ -190,20 +360,13 @@ async def assess_risks_simple(
 
 @app.get("/api/models")
 async def list_models():
-    """List available Gemini models"""
+    """List available Gemini models (cached for MODELS_CACHE_TTL seconds)"""
     try:
-        import google.generativeai as genai
-        
-        models = []
-        for model in genai.list_models():
-            if 'generateContent' in model.supported_generation_methods:
-                models.append({
-                    "name": model.name,
-                    "display_name": model.display_name,
-                    "description": model.description
-                })
+        fetched_at = app.state.models_fetched_at
+        if fetched_at is None or time.monotonic() - fetched_at > config.MODELS_CACHE_TTL:
+            await refresh_models()
         
-        return {"models": models}
+        return {"models": app.state.models}
         
     except Exception as e:
         logger.error(f"Failed to list models: {e}")
@@ -218,7 +381,9 @@ async def root():
         "status": "running",
         "endpoints": {
             "health": "/api/health",
+            "liveness": "/api/health/live",
             "assess": "/api/v1/assess-risks",
+            "assess_stream": "/api/v1/assess-risks/stream",
             "assess_simple": "/api/v1/assess-risks-simple",
             "models": "/api/models"
         }
@@ -229,6 +394,7 @@ if __name__ == "__main__":
         "app:app",
         host=config.SERVICE_HOST,
         port=config.SERVICE_PORT,
-        log_level=config.LOG_LEVEL.lower(),
-        reload=False
+        workers=config.SERVICE_WORKERS,
+        loop="auto",  # uvloop when installed
+        log_level=config.LOG_LEVEL.lower()
     )
@@ -0,0 +1,148 @@
+# Response Cache
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import orjson
+from typing import Any, Awaitable, Callable, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+def fingerprint(data: Any) -> str:
+    """SHA1 of the canonical JSON encoding of data"""
+    canonical = orjson.dumps(data, option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.sha1(canonical).hexdigest()
+
+class ResponseCache:
+    """
+    SQLite-backed exact-match response cache
+    
+    Entries are keyed by namespace and key, and expire after their TTL;
+    expired rows are swept on open and then every CACHE_PURGE_INTERVAL as
+    entries are written.
+    
+    SQLite calls block, so async callers should use aget/aset, which run
+    them on a worker thread.
+    """
+    
+    def __init__(self, path: str = None, ttl: int = None):
+        self.path = path or config.CACHE_DB_PATH
+        self.ttl = ttl or config.CACHE_TTL_SECONDS
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets several worker processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        # Keeps purges from scanning the whole table
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_expires_at ON cache_entries (expires_at)")
+        self._conn.commit()
+        
+        self._last_purge = 0.0
+        self.purge_expired()
+        
+        logger.info(f"Initialized response cache at {self.path}")
+    
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        """
+        Look up a cached payload
+        
+        Args:
+            namespace: Partition to search (e.g. per CFP)
+            key: Exact-match key
+        
+        Returns:
+            Cached payload, or None on miss
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time())
+            ).fetchone()
+        
+        if row:
+            logger.info(f"Cache hit in {namespace}")
+            return row[0]
+        return None
+    
+    def set(self, namespace: str, key: str, payload: str, ttl: int = None):
+        """Store a payload"""
+        expires_at = time.time() + (ttl or self.ttl)
+        
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, payload, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, payload, expires_at)
+            )
+            self._conn.commit()
+        
+        if time.monotonic() - self._last_purge >= config.CACHE_PURGE_INTERVAL:
+            self.purge_expired()
+    
+    async def aget(self, namespace: str, key: str) -> Optional[str]:
+        """get without blocking the event loop"""
+        return await asyncio.to_thread(self.get, namespace, key)
+    
+    async def aset(self, namespace: str, key: str, payload: str, ttl: int = None):
+        """set without blocking the event loop"""
+        await asyncio.to_thread(self.set, namespace, key, payload, ttl)
+    
+    def purge_expired(self) -> int:
+        """Delete expired entries, returning the number removed"""
+        with self._lock:
+            self._last_purge = time.monotonic()
+            removed = self._conn.execute(
+                "DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+            self._conn.commit()
+        
+        if removed:
+            logger.info(f"Purged {removed} expired cache entries")
+        return removed
+
+class HealthCheckCache:
+    """
+    Reuse a health probe's result for HEALTH_CHECK_TTL seconds
+    
+    Each real check is a network request, so frequent polling (load
+    balancers hitting /api/health) reuses a recent answer instead. Callers
+    arriving while a probe is running share it rather than starting their
+    own. A probe that is cancelled or raises leaves nothing cached.
+    """
+    
+    def __init__(self, probe: Callable[[], Awaitable[bool]], ttl: float = None):
+        self.probe = probe
+        self.ttl = ttl or config.HEALTH_CHECK_TTL
+        self._result = None  # (checked_at, healthy) from the last probe
+        self._inflight = None
+    
+    async def get(self) -> bool:
+        """Recent probe result, probing first if there is none"""
+        if self._result and time.monotonic() - self._result[0] < self.ttl:
+            return self._result[1]
+        
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._run())
+        # Shielded so one caller giving up doesn't cancel the probe for the rest
+        return await asyncio.shield(self._inflight)
+    
+    async def _run(self) -> bool:
+        try:
+            healthy = await self.probe()
+            self._result = (time.monotonic(), healthy)
+            return healthy
+        finally:
+            self._inflight = None
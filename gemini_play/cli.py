@@ -2,11 +2,13 @@
 # Risk Assessment CLI Tool
 
 import argparse
-import json
+import asyncio
+import orjson
 import sys
 import os
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -14,18 +16,24 @@ load_dotenv()
 
 from risk_engine import RiskAssessmentEngine
 from db_service import DatabaseServiceClient
-from llm_service import GeminiLLMService
+from llm_service import get_llm_service
+from event_loop import use_fast_event_loop
 from models import ProposalSchema
+import config
+
+def read_proposal_file(file_path: str) -> Dict[str, Any]:
+    """Read and parse a proposal JSON file, raising OSError or orjson.JSONDecodeError"""
+    with open(file_path, 'rb') as f:
+        return orjson.loads(f.read())
 
 def load_proposal_from_file(file_path: str) -> Dict[str, Any]:
     """Load proposal from JSON file"""
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        return read_proposal_file(file_path)
     except FileNotFoundError:
         print(f"Error: File not found: {file_path}")
         sys.exit(1)
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"Error: Invalid JSON in file {file_path}: {e}")
         sys.exit(1)
 
@@ -36,6 +44,20 @@ def load_proposal_from_text(text: str) -> Dict[str, Any]:
         "proposal_title": "CLI Input Proposal"
     }
 
+@lru_cache(maxsize=1)
+def get_engine() -> RiskAssessmentEngine:
+    """Create the engine once per process so its clients and pools are reused"""
+    db_client = DatabaseServiceClient()
+    llm_service = get_llm_service()
+    return RiskAssessmentEngine(db_client, llm_service)
+
+async def run_with_engine(engine: RiskAssessmentEngine, coro):
+    """Await coro, then release the engine's network connections"""
+    try:
+        return await coro
+    finally:
+        await engine.aclose()
+
 def print_assessment_result(result):
     """Print assessment result in a readable format"""
     print("\n" + "="*80)
@@ -74,17 +96,17 @@ def assess_command(args):
         
         # Initialize services
         print("Initializing risk assessment engine...")
-        db_client = DatabaseServiceClient()
-        llm_service = GeminiLLMService()
-        engine = RiskAssessmentEngine(db_client, llm_service)
+        engine = get_engine()
         
         # Perform assessment
         print("Performing risk assessment...")
-        result = engine.assess_proposal(proposal_data)
+        result = asyncio.run(run_with_engine(
+            engine, engine.assess_proposal(proposal_data, use_cache=not args.no_cache)
+        ))
         
         # Output result
         if args.output_format == "json":
-            print(json.dumps(result.dict(), indent=2, default=str))
+            print(orjson.dumps(result.model_dump(), option=orjson.OPT_INDENT_2).decode())
         else:
             print_assessment_result(result)
         
@@ -95,11 +117,9 @@ def assess_command(args):
 def health_command(args):
     """Handle health command"""
     try:
-        db_client = DatabaseServiceClient()
-        llm_service = GeminiLLMService()
-        engine = RiskAssessmentEngine(db_client, llm_service)
+        engine = get_engine()
         
-        health_status = engine.health_check()
+        health_status = asyncio.run(run_with_engine(engine, engine.health_check()))
         
         print("Health Check Results:")
         print("-" * 40)
@@ -134,41 +154,127 @@ def test_command(args):
         
         # Initialize services
         print("Initializing risk assessment engine...")
-        db_client = DatabaseServiceClient()
-        llm_service = GeminiLLMService()
-        engine = RiskAssessmentEngine(db_client, llm_service)
+        engine = get_engine()
         
         # Test each proposal
-        results = []
-        for proposal_file in proposal_files:
-            print(f"\nTesting: {proposal_file.name}")
-            proposal_data = load_proposal_from_file(str(proposal_file))
-            
-            result = engine.assess_proposal(proposal_data)
-            results.append({
-                "file": proposal_file.name,
-                "assessment_id": result.assessment_id,
-                "risks_count": len(result.risks),
-                "risk_ids": [r.risk_id for r in result.risks]
-            })
-            
-            if args.verbose:
-                print_assessment_result(result)
+        results = asyncio.run(run_with_engine(
+            engine, assess_proposal_files(engine, proposal_files, args.verbose)
+        ))
         
         # Summary
         print("\n" + "="*60)
         print("TEST SUMMARY")
         print("="*60)
+        failures = [result for result in results if "error" in result]
         for result in results:
-            print(f"{result['file']}: {result['risks_count']} risks - {result['risk_ids']}")
+            if "error" in result:
+                print(f"{result['file']}: FAILED - {result['error']}")
+            else:
+                print(f"{result['file']}: {result['risks_count']} risks - {result['risk_ids']}")
         
         print(f"\nTotal tests: {len(results)}")
+        if failures:
+            print(f"{len(failures)} test(s) failed")
+            sys.exit(1)
         print("All tests completed successfully!")
         
     except Exception as e:
         print(f"Test failed: {e}")
         sys.exit(1)
 
+async def assess_proposal_files(engine: RiskAssessmentEngine, proposal_files, verbose: bool):
+    """
+    Assess proposal files concurrently and collect a summary per file
+    
+    At most CLI_CONCURRENCY assessments run at once to stay within Gemini
+    rate limits. Summaries are returned in the same order as proposal_files.
+    """
+    # Load everything up front so a bad file fails before any LLM calls
+    proposals = [load_proposal_from_file(str(f)) for f in proposal_files]
+    
+    await engine.warmup()
+    
+    semaphore = asyncio.Semaphore(config.CLI_CONCURRENCY)
+    completed = 0
+    
+    async def assess(proposal_file, proposal_data):
+        nonlocal completed
+        async with semaphore:
+            result = await engine.assess_proposal(proposal_data)
+        completed += 1
+        print(f"[{completed}/{len(proposal_files)}] Tested: {proposal_file.name}")
+        return result
+    
+    outcomes = await asyncio.gather(
+        *(assess(f, p) for f, p in zip(proposal_files, proposals)),
+        return_exceptions=True
+    )
+    
+    results = []
+    for proposal_file, outcome in zip(proposal_files, outcomes):
+        if isinstance(outcome, Exception):
+            results.append({"file": proposal_file.name, "error": str(outcome)})
+            continue
+        
+        results.append({
+            "file": proposal_file.name,
+            "assessment_id": outcome.assessment_id,
+            "risks_count": len(outcome.risks),
+            "risk_ids": [r.risk_id for r in outcome.risks]
+        })
+        
+        if verbose:
+            print(f"\nResult for: {proposal_file.name}")
+            print_assessment_result(outcome)
+    
+    return results
+
+def serve_command(args):
+    """Handle serve command"""
+    try:
+        print("Initializing risk assessment engine...", file=sys.stderr)
+        engine = get_engine()
+        
+        asyncio.run(run_with_engine(engine, serve_proposals(engine, args.output_format)))
+        
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+async def serve_proposals(engine: RiskAssessmentEngine, output_format: str):
+    """Assess proposal files whose paths are read from stdin, one per line"""
+    await engine.warmup()
+    print("Ready - enter proposal file paths, one per line", file=sys.stderr)
+    
+    while True:
+        line = await asyncio.to_thread(sys.stdin.readline)
+        if not line:
+            break
+        
+        file_path = line.strip()
+        if not file_path:
+            continue
+        
+        # A bad path or file only fails its own line; the server keeps going
+        try:
+            proposal_data = read_proposal_file(file_path)
+        except (OSError, orjson.JSONDecodeError) as e:
+            if output_format == "json":
+                print(orjson.dumps({"file": file_path, "error": str(e)}).decode(), flush=True)
+            else:
+                print(f"Error: Could not load {file_path}: {e}", flush=True)
+            continue
+        
+        result = await engine.assess_proposal(proposal_data)
+        
+        if output_format == "json":
+            print(orjson.dumps(result.model_dump()).decode(), flush=True)
+        else:
+            print_assessment_result(result)
+            sys.stdout.flush()
+
 def create_samples_command(args):
     """Handle create-samples command"""
     try:
@@ -205,20 +311,30 @@ def create_samples_command(args):
             }
         }
         
-        # Write sample files
+        # Write sample files, leaving ones that already match untouched
         for filename, data in samples.items():
             filepath = sample_dir / filename
-            with open(filepath, 'w') as f:
-                json.dump(data, f, indent=2)
+            if filepath.exists() and load_existing_sample(filepath) == data:
+                print(f"Unchanged: {filepath}")
+                continue
+            
+            filepath.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
             print(f"Created: {filepath}")
         
-        print(f"\nCreated {len(samples)} sample proposals in {sample_dir}")
+        print(f"\nSample proposals ready in {sample_dir}")
         print("Run 'python cli.py test' to test them")
         
     except Exception as e:
         print(f"Error creating samples: {e}")
         sys.exit(1)
 
+def load_existing_sample(filepath: Path) -> Optional[Dict[str, Any]]:
+    """Read a previously written sample, or None if it can't be parsed"""
+    try:
+        return orjson.loads(filepath.read_bytes())
+    except orjson.JSONDecodeError:
+        return None
+
 def main():
     """Main CLI entry point"""
     parser = argparse.ArgumentParser(
@@ -230,6 +346,8 @@ Examples:
   python cli.py assess --proposal-text "We want to build a chatbot"
   python cli.py health
   python cli.py test
+  CLI_CONCURRENCY=4 python cli.py test
+  ls sample_proposals/*.json | python cli.py serve --output-format json
   python cli.py create-samples
         """
     )
@@ -243,6 +361,7 @@ Examples:
     assess_group.add_argument('--proposal-text', help='Proposal text directly')
     assess_parser.add_argument('--output-format', choices=['text', 'json'], default='text',
                               help='Output format (default: text)')
+    assess_parser.add_argument('--no-cache', action='store_true', help='Bypass the response cache')
     
     # Health command
     health_parser = subparsers.add_parser('health', help='Check service health')
@@ -251,6 +370,11 @@ Examples:
     test_parser = subparsers.add_parser('test', help='Test with sample proposals')
     test_parser.add_argument('--verbose', action='store_true', help='Show detailed results')
     
+    # Serve command
+    serve_parser = subparsers.add_parser('serve', help='Assess proposal files read from stdin')
+    serve_parser.add_argument('--output-format', choices=['text', 'json'], default='text',
+                              help='Output format (default: text; json emits one line per result)')
+    
     # Create samples command
     samples_parser = subparsers.add_parser('create-samples', help='Create sample proposals')
     
@@ -266,6 +390,9 @@ Examples:
         print("Set it with: export GEMINI_API_KEY='your_api_key_here'")
         sys.exit(1)
     
+    # Faster event loop for the concurrent Gemini and database I/O
+    use_fast_event_loop()
+    
     # Route to appropriate command handler
     if args.command == 'assess':
         assess_command(args)
@@ -273,6 +400,8 @@ Examples:
         health_command(args)
     elif args.command == 'test':
         test_command(args)
+    elif args.command == 'serve':
+        serve_command(args)
     elif args.command == 'create-samples':
         create_samples_command(args)
 
@@ -1,23 +1,52 @@
 # Risk Assessment Engine Configuration
 
+import os
+
 # Service Configuration
 SERVICE_NAME = "risk-assessment-service"
 SERVICE_PORT = 5005
 SERVICE_HOST = "0.0.0.0"
+SERVICE_WORKERS = int(os.getenv("WEB_CONCURRENCY", "4"))
+HEALTH_CHECK_TTL = 30  # Seconds a dependency health result is reused before re-probing
 
 # LLM Configuration
 LLM_PROVIDER = "gemini"
 LLM_MODEL = "gemini-2.0-flash"
 LLM_TEMPERATURE = 0
 LLM_MAX_TOKENS = 2048
+LLM_MODEL_CONTEXT = 1_048_576  # Input + output token limit of LLM_MODEL
+MODELS_CACHE_TTL = 60 * 60  # Seconds to cache the /api/models list
 
 # Database Configuration
 DATABASE_SERVICE_URL = "http://localhost:5001"
 DATABASE_TIMEOUT = 30
+DATABASE_MAX_CONNECTIONS = 32  # Pooled keep-alive connections to the database service
+DATABASE_KEEPALIVE_EXPIRY = 30  # Seconds an idle connection stays open
+DATABASE_RETRIES = 2  # Retries on connection failures
+SEARCH_KEYWORD_LIMIT = 3  # Keywords searched per proposal, in order
 
 # Assessment Configuration
 TOP_N_RISKS = 3
 MAX_CANDIDATE_RISKS = 30
+PROMPT_RISK_DESCRIPTION_CHARS = 280  # Risk descriptions are truncated to this length in prompts
+RANKING_BATCH_SIZE = 5  # Max proposals ranked together in one Gemini request
+RANKING_BATCH_MAX_TOKENS = 8192  # Output token budget for a multi-proposal ranking
+MAX_CONCURRENT_LLM = int(os.getenv("MAX_CONCURRENT_LLM", "8"))  # Max in-flight Gemini calls per engine
+
+# CLI Configuration
+CLI_CONCURRENCY = int(os.getenv("CLI_CONCURRENCY", "8"))  # Max concurrent assessments in `cli.py test`
+
+# Batching Configuration
+BATCH_MAX_SIZE = 8  # Max proposals coalesced into one batch
+BATCH_MAX_DELAY = 0.1  # Seconds to wait for a batch to fill
+
+# Cache Configuration
+CACHE_ENABLED = True
+CACHE_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assessment_cache.db")
+CACHE_TTL_SECONDS = 24 * 60 * 60
+CACHE_PURGE_INTERVAL = 60 * 60  # Seconds between sweeps of expired entries
+LLM_CACHE_ENABLED = True  # Cache Gemini stage results; only services sampling at temperature 0 use it
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
 
 # Logging Configuration
 LOG_LEVEL = "INFO"
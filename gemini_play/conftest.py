@@ -0,0 +1,4 @@
+# pytest configuration
+
+# test_engine.py is a standalone script against live services, not a pytest module
+collect_ignore = ["test_engine.py"]
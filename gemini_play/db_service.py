@@ -1,18 +1,33 @@
 # Database Service Client
 
-import requests
+import asyncio
+import httpx
 import logging
+import orjson
+import re
+from functools import lru_cache
 from typing import List, Dict, Optional
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
 
 from models import Risk, Control
+from cache import HealthCheckCache
 import config
 
 logger = logging.getLogger(__name__)
 
+# Keep only alphanumeric, spaces, hyphens, underscores
+_KEYWORD_RE = re.compile(r'[^a-zA-Z0-9\s\-_]')
+# Risk IDs should match pattern R.AIR.XXX or similar
+_RISK_ID_RE = re.compile(r'^R\.[A-Z]+\.[0-9]+$')
+
+@lru_cache(maxsize=4096)
+def _make_control(control_id: str, risk_id: str) -> Control:
+    """Create a basic control object (we don't have full control details)"""
+    return Control(
+        control_id=control_id,
+        control_title=f"Control {control_id}",
+        control_description=f"Control for risk {risk_id}"
+    )
+
 class DatabaseServiceClient:
     """
     Client for existing database-service API
@@ -24,9 +39,20 @@ class DatabaseServiceClient:
     def __init__(self, base_url: str = None, timeout: int = None):
         self.base_url = base_url or config.DATABASE_SERVICE_URL
         self.timeout = timeout or config.DATABASE_TIMEOUT
-        self.session = requests.Session()
+        # Keep connections to the internal service warm; the transport only
+        # retries failed connects, so a slow or failing request is not repeated
+        transport = httpx.AsyncHTTPTransport(
+            retries=config.DATABASE_RETRIES,
+            limits=httpx.Limits(
+                max_connections=config.DATABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=config.DATABASE_MAX_CONNECTIONS,
+                keepalive_expiry=config.DATABASE_KEEPALIVE_EXPIRY
+            )
+        )
+        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, transport=transport)
+        self._health = HealthCheckCache(self._probe_health)
         
-    def search_risks(self, keywords: List[str]) -> List[Risk]:
+    async def search_risks(self, keywords: List[str]) -> List[Risk]:
         """
         Search risks via database-service REST API
         GET /api/search?q=keywords
@@ -38,19 +64,21 @@ class DatabaseServiceClient:
             # Sanitize keywords - remove any potential SQL injection
             sanitized_keywords = [self._sanitize_keyword(k) for k in keywords]
             
-            # Search with individual keywords and combine results
+            # Search with individual keywords in parallel and combine results
+            search_keywords = sanitized_keywords[:config.SEARCH_KEYWORD_LIMIT]
+            for keyword in search_keywords:
+                logger.debug(f"Searching risks with keyword: {keyword}")
+            
+            responses = await asyncio.gather(*(
+                self.client.get("/api/search", params={"q": keyword})
+                for keyword in search_keywords
+            ))
+            
             all_risks = {}
-            for keyword in sanitized_keywords[:3]:  # Limit to first 3 keywords
-                logger.info(f"Searching risks with keyword: {keyword}")
-                
-                response = self.session.get(
-                    f"{self.base_url}/api/search",
-                    params={"q": keyword},
-                    timeout=self.timeout
-                )
+            for response in responses:
                 response.raise_for_status()
                 
-                data = response.json()
+                data = orjson.loads(response.content)
                 
                 # Convert to Risk objects
                 for item in data.get("results", []):
@@ -68,14 +96,14 @@ class DatabaseServiceClient:
             logger.info(f"Found {len(risks)} unique risks for keywords: {sanitized_keywords}")
             return risks
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Failed to search risks: {e}")
             raise Exception(f"Database service unavailable: {e}")
         except Exception as e:
             logger.error(f"Error searching risks: {e}")
             raise
     
-    def get_controls_for_risks(self, risk_ids: List[str]) -> Dict[str, List[Control]]:
+    async def get_controls_for_risks(self, risk_ids: List[str]) -> Dict[str, List[Control]]:
         """
         Fetch controls via database-service REST API
         GET /api/relationships?risk_ids=R.AIR.001,R.AIR.002
@@ -89,58 +117,47 @@ class DatabaseServiceClient:
             
             logger.info(f"Fetching controls for risks: {validated_ids}")
             
-            response = self.session.get(
-                f"{self.base_url}/api/relationships",
-                params={"risk_ids": ",".join(validated_ids)},
-                timeout=self.timeout
+            response = await self.client.get(
+                "/api/relationships",
+                params={"risk_ids": ",".join(validated_ids)}
             )
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
-            # Convert to Control objects organized by risk_id
-            controls_by_risk = {}
-            for risk_id in validated_ids:
-                controls_by_risk[risk_id] = []
+            # Convert to Control objects organized by risk_id, in a single pass
+            controls_by_risk = {risk_id: [] for risk_id in validated_ids}
+            for relationship in data:
+                if relationship.get("relationship_type") != "risk_control":
+                    continue
                 
-                # Find controls for this risk from the relationships list
-                for relationship in data:
-                    if (relationship.get("source_id") == risk_id and 
-                        relationship.get("relationship_type") == "risk_control"):
-                        control_id = relationship.get("target_id")
-                        if control_id:
-                            # Create a basic control object (we don't have full control details)
-                            controls_by_risk[risk_id].append(Control(
-                                control_id=control_id,
-                                control_title=f"Control {control_id}",
-                                control_description=f"Control for risk {risk_id}"
-                            ))
+                risk_id = relationship.get("source_id")
+                control_id = relationship.get("target_id")
+                if control_id and risk_id in controls_by_risk:
+                    controls_by_risk[risk_id].append(_make_control(control_id, risk_id))
             
             logger.info(f"Found controls for {len(controls_by_risk)} risks")
             return controls_by_risk
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Failed to fetch controls: {e}")
             raise Exception(f"Database service unavailable: {e}")
         except Exception as e:
             logger.error(f"Error fetching controls: {e}")
             raise
     
-    def get_risk_by_id(self, risk_id: str) -> Optional[Risk]:
+    async def get_risk_by_id(self, risk_id: str) -> Optional[Risk]:
         """Get a specific risk by ID"""
         try:
             validated_id = self._validate_risk_id(risk_id)
             
-            response = self.session.get(
-                f"{self.base_url}/api/risks/{validated_id}",
-                timeout=self.timeout
-            )
+            response = await self.client.get(f"/api/risks/{validated_id}")
             
             if response.status_code == 404:
                 return None
                 
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             return Risk(
                 risk_id=data["id"],
@@ -148,34 +165,35 @@ class DatabaseServiceClient:
                 risk_description=data["description"]
             )
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Failed to get risk {risk_id}: {e}")
             return None
     
-    def health_check(self) -> bool:
-        """Check if database service is healthy"""
+    async def health_check(self) -> bool:
+        """Check if database service is healthy, reusing a result up to HEALTH_CHECK_TTL old"""
+        return await self._health.get()
+    
+    async def _probe_health(self) -> bool:
+        """Ask the database service whether it is healthy"""
+        # Cancellation propagates, so it never stores a false "unhealthy"
         try:
-            response = self.session.get(
-                f"{self.base_url}/api/health",
-                timeout=5
-            )
+            response = await self.client.get("/api/health", timeout=5)
             return response.status_code == 200
-        except:
+        except httpx.HTTPError as e:
+            logger.error(f"Database health check failed: {e}")
             return False
     
+    async def aclose(self):
+        """Close the underlying HTTP connection pool"""
+        await self.client.aclose()
+    
     def _sanitize_keyword(self, keyword: str) -> str:
         """Sanitize keyword to prevent injection attacks"""
-        # Remove any characters that could be used for SQL injection
-        import re
-        # Keep only alphanumeric, spaces, hyphens, underscores
-        sanitized = re.sub(r'[^a-zA-Z0-9\s\-_]', '', keyword)
-        # Limit length
-        return sanitized[:100]
+        # Remove any characters that could be used for SQL injection, limit length
+        return _KEYWORD_RE.sub('', keyword)[:100]
     
     def _validate_risk_id(self, risk_id: str) -> str:
         """Validate risk ID format"""
-        import re
-        # Risk IDs should match pattern R.AIR.XXX or similar
-        if not re.match(r'^R\.[A-Z]+\.[0-9]+$', risk_id):
+        if not _RISK_ID_RE.match(risk_id):
             raise ValueError(f"Invalid risk ID format: {risk_id}")
         return risk_id
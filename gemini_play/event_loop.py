@@ -0,0 +1,23 @@
+# Event Loop Selection
+#
+# uvloop is a faster drop-in event loop for the concurrent Gemini and
+# database I/O. It is optional (not available on Windows), so everything
+# here falls back to the stock asyncio loop without it.
+
+import asyncio
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+def use_fast_event_loop():
+    """Make asyncio.run and friends create uvloop loops when it's installed"""
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    """A new uvloop loop when installed, else a stock asyncio one"""
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
@@ -1,221 +1,614 @@
 # Gemini LLM Service
 
 import os
+import asyncio
+import hashlib
 import json
 import logging
+import re
+from contextlib import nullcontext
+from functools import lru_cache
 import google.generativeai as genai
-from typing import List, Dict, Any
-from dotenv import load_dotenv
-from models import KeywordExtractionResult, RiskRankingResult, Risk
-from prompts import format_keyword_extraction_prompt, format_risk_ranking_prompt, format_candidate_risks
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Type, TypeVar, Union
+from pydantic import BaseModel, ValidationError
+from models import (
+    KeywordExtractionResult, RiskRankingResult, Risk, ProposalSchema,
+    LLMKeywordResponse, LLMRankResponse, LLMRankBatchResponse, RankedRisk
+)
+from prompts import (
+    format_keyword_extraction_prompt, format_risk_ranking_prompt, format_candidate_risks,
+    format_risk_ranking_batch_prompt, format_batch_proposals
+)
+from cache import ResponseCache, HealthCheckCache
 import config
 
-# Load environment variables from .env file
-load_dotenv()
-
 logger = logging.getLogger(__name__)
 
+ResultT = TypeVar("ResultT", bound=BaseModel)
+
+# Proposal fields included in prompts, in order, with their labels
+_PROPOSAL_FIELDS = (
+    ("proposal_title", "Title"),
+    ("description", "Description"),
+    ("technical_approach", "Technical Approach"),
+    ("data_sources", "Data Sources"),
+    ("deployment", "Deployment"),
+    ("data_governance", "Data Governance"),
+    ("model_governance", "Model Governance"),
+    ("security_measures", "Security Measures"),
+)
+
+# Cache namespaces, one per stage so their prompts never collide
+KEYWORD_CACHE_NAMESPACE = "llm:keywords"
+RANKING_CACHE_NAMESPACE = "llm:ranking"
+
+# Prompt tokens available once the response and a safety margin are reserved
+MAX_INPUT_TOKENS = config.LLM_MODEL_CONTEXT - config.LLM_MAX_TOKENS - 512
+
+# Response schemas mirroring the models in models.py; Gemini constrains
+# decoding to them so responses arrive well-formed
+_Schema = genai.protos.Schema
+_Type = genai.protos.Type
+
+KEYWORD_RESPONSE_SCHEMA = _Schema(
+    type=_Type.OBJECT,
+    properties={
+        "keywords": _Schema(type=_Type.ARRAY, items=_Schema(type=_Type.STRING), min_items=1),
+        "confidence": _Schema(type=_Type.NUMBER),
+    },
+    required=["keywords", "confidence"]
+)
+
+_RANKED_RISKS_SCHEMA = _Schema(
+    type=_Type.ARRAY,
+    items=_Schema(
+        type=_Type.OBJECT,
+        properties={
+            "risk_id": _Schema(type=_Type.STRING),
+            "reasoning": _Schema(type=_Type.STRING),
+        },
+        required=["risk_id", "reasoning"]
+    ),
+    min_items=config.TOP_N_RISKS,
+    max_items=config.TOP_N_RISKS
+)
+
+RANKING_RESPONSE_SCHEMA = _Schema(
+    type=_Type.OBJECT,
+    properties={"risks": _RANKED_RISKS_SCHEMA},
+    required=["risks"]
+)
+
+RANKING_BATCH_RESPONSE_SCHEMA = _Schema(
+    type=_Type.OBJECT,
+    properties={
+        "results": _Schema(
+            type=_Type.ARRAY,
+            items=_Schema(
+                type=_Type.OBJECT,
+                properties={
+                    "proposal_id": _Schema(type=_Type.STRING),
+                    "risks": _RANKED_RISKS_SCHEMA,
+                },
+                required=["proposal_id", "risks"]
+            )
+        )
+    },
+    required=["results"]
+)
+
+_RISKS_ARRAY_RE = re.compile(r'"risks"\s*:\s*\[')
+_ITEM_SEPARATOR_RE = re.compile(r'[\s,]*')
+
+class _RankedRiskParser:
+    """
+    Pull complete items out of a streamed {"risks": [...]} response
+    
+    Each chunk is appended to the buffer, and any risk objects that are now
+    complete are decoded; a partial object is retried on the next chunk.
+    """
+    
+    _decoder = json.JSONDecoder()
+    
+    def __init__(self):
+        self.text = ""
+        self.pos = None  # Where the next item starts, once the array is found
+    
+    def feed(self, chunk: str) -> List[Dict]:
+        """Add a chunk of response text, returning the risks it completed"""
+        self.text += chunk
+        items = []
+        
+        if self.pos is None:
+            match = _RISKS_ARRAY_RE.search(self.text)
+            if not match:
+                return items
+            self.pos = match.end()
+        
+        while True:
+            start = _ITEM_SEPARATOR_RE.match(self.text, self.pos).end()
+            if not self.text.startswith("{", start):
+                return items
+            try:
+                item, self.pos = self._decoder.raw_decode(self.text, start)
+            except json.JSONDecodeError:
+                # Not fully generated yet
+                return items
+            items.append(item)
+
+# API key genai is currently configured with
+_configured_key = None
+
+def _ensure_configured(api_key: str):
+    """Configure genai for api_key, skipping the call if it already is"""
+    global _configured_key
+    if api_key != _configured_key:
+        genai.configure(api_key=api_key)
+        _configured_key = api_key
+
+@lru_cache(maxsize=1)
+def get_llm_service() -> "GeminiLLMService":
+    """
+    Process-wide GeminiLLMService
+    
+    The SDK keeps long-lived gRPC (HTTP/2) channels per configured client,
+    and every genai.configure call discards them. Sharing one service keeps
+    those connections warm across calls instead of re-handshaking.
+    """
+    return GeminiLLMService()
+
 class GeminiLLMService:
     """Gemini LLM integration with anti-hallucination"""
     
-    def __init__(self, api_key: str = None, model: str = None, temperature: float = None):
+    def __init__(self, api_key: str = None, model: str = None, temperature: float = None,
+                 cache: Union[ResponseCache, bool] = None):
         self.api_key = api_key or os.getenv('GEMINI_API_KEY')
         self.model_name = model or config.LLM_MODEL
         self.temperature = temperature or config.LLM_TEMPERATURE
         
+        # Stage results are only reusable when sampling is deterministic;
+        # cache=False turns caching off outright
+        if isinstance(cache, ResponseCache):
+            self.cache = cache
+        elif cache is False or not config.LLM_CACHE_ENABLED or self.temperature != 0:
+            self.cache = None
+        else:
+            self.cache = ResponseCache(ttl=config.LLM_CACHE_TTL_SECONDS)
+        
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY environment variable is required")
         
         # Configure Gemini
-        genai.configure(api_key=self.api_key)
+        _ensure_configured(self.api_key)
         
         # Create model instance
         self.model = genai.GenerativeModel(self.model_name)
         
+        self._health = HealthCheckCache(self._probe_health)
+        
         logger.info(f"Initialized Gemini LLM service with model: {self.model_name}")
     
-    def extract_keywords(self, proposal: Dict[str, Any]) -> KeywordExtractionResult:
+    async def extract_keywords_async(self, proposal: Union[ProposalSchema, str],
+                                     use_cache: bool = True) -> KeywordExtractionResult:
         """
         Stage 1: Extract risk themes from proposal
         
         Args:
-            proposal: Proposal dictionary with description and other fields
+            proposal: Proposal, or its text from format_proposal_text
+            use_cache: Reuse results for identical prompts
             
         Returns:
             KeywordExtractionResult with extracted keywords
         """
         try:
-            # Convert proposal to text
-            proposal_text = self._format_proposal_text(proposal)
+            proposal_text = self._proposal_text(proposal)
+            prompt = self._build_keyword_prompt(proposal_text)
             
-            # Create prompt
-            prompt = format_keyword_extraction_prompt(proposal_text)
+            if use_cache:
+                cached = await self._get_cached(KEYWORD_CACHE_NAMESPACE, prompt, KeywordExtractionResult)
+                if cached:
+                    return cached
             
             logger.info("Extracting keywords from proposal")
             
             # Generate response
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=self.temperature,
-                    max_output_tokens=config.LLM_MAX_TOKENS,
-                    response_mime_type="application/json"
-                )
+            response = await self.model.generate_content_async(
+                prompt, generation_config=self._json_generation_config(KEYWORD_RESPONSE_SCHEMA)
             )
             
-            # Parse JSON response
-            result_data = json.loads(response.text)
-            
-            # Validate response structure
-            if "keywords" not in result_data or "confidence" not in result_data:
-                raise ValueError("Invalid response format from LLM")
-            
-            keywords = result_data["keywords"]
-            confidence = float(result_data["confidence"])
+            result = self._parse_keyword_response(response)
+            if use_cache:
+                await self._set_cached(KEYWORD_CACHE_NAMESPACE, prompt, result)
+            return result
             
-            # Validate keywords
-            if not isinstance(keywords, list) or len(keywords) == 0:
-                raise ValueError("No keywords extracted")
-            
-            logger.info(f"Extracted keywords: {keywords} (confidence: {confidence})")
-            
-            return KeywordExtractionResult(
-                keywords=keywords,
-                confidence=confidence
-            )
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse LLM response as JSON: {e}")
-            logger.error(f"Raw response: {response.text}")
-            raise Exception("Invalid JSON response from LLM")
         except Exception as e:
             logger.error(f"Error extracting keywords: {e}")
             raise
     
-    def rank_and_select(self, proposal: Dict[str, Any], risks: List[Risk]) -> RiskRankingResult:
+    async def rank_and_select_async(self, proposal: Union[ProposalSchema, str], risks: List[Risk],
+                                    use_cache: bool = True) -> RiskRankingResult:
         """
         Stage 2: Rank filtered risks and select top 3
         
         Args:
-            proposal: Proposal dictionary
+            proposal: Proposal to assess, or its text from format_proposal_text
             risks: List of candidate risks (should be ~20-30)
+            use_cache: Reuse rankings for identical prompts
             
         Returns:
             RiskRankingResult with top 3 risks and reasoning
         """
         try:
-            # Limit candidate risks to prevent context overflow
-            if len(risks) > config.MAX_CANDIDATE_RISKS:
-                risks = risks[:config.MAX_CANDIDATE_RISKS]
-                logger.warning(f"Limited candidate risks to {config.MAX_CANDIDATE_RISKS}")
+            proposal_text = self._proposal_text(proposal)
+            prompt, risks = self._build_ranking_prompt(proposal_text, risks)
             
-            # Format proposal text
-            proposal_text = self._format_proposal_text(proposal)
+            if use_cache:
+                cached = await self._get_cached_ranking(prompt, risks)
+                if cached:
+                    return cached
             
-            # Format candidate risks
-            candidate_risks_text = format_candidate_risks([
-                {
-                    "risk_id": r.risk_id,
-                    "risk_title": r.risk_title,
-                    "risk_description": r.risk_description
-                }
-                for r in risks
-            ])
+            return await self._rank(prompt, risks, use_cache)
             
-            # Create prompt
-            prompt = format_risk_ranking_prompt(proposal_text, candidate_risks_text)
+        except Exception as e:
+            logger.error(f"Error ranking risks: {e}")
+            raise
+    
+    async def rank_and_select_stream(self, proposal: Union[ProposalSchema, str], risks: List[Risk],
+                                     use_cache: bool = True,
+                                     slots: Optional[asyncio.Semaphore] = None) -> AsyncIterator[Dict[str, str]]:
+        """
+        Stage 2, yielding each ranked risk as soon as Gemini has written it
+        
+        The response is streamed and parsed incrementally, so callers can
+        start on the top risk while the rest are still being generated. The
+        complete response is validated and cached as in rank_and_select_async
+        once the last risk is out; a cached ranking is yielded all at once.
+        
+        Args:
+            proposal: Proposal, or its text from format_proposal_text
+            risks: Candidate risks from database
+            use_cache: Reuse rankings for identical prompts
+            slots: Held while Gemini is generating the response, but not
+                while the caller works through the risks yielded
             
-            logger.info(f"Ranking {len(risks)} candidate risks")
+        Yields:
+            {"risk_id": ..., "reasoning": ...} per ranked risk, in rank order
+        """
+        try:
+            proposal_text = self._proposal_text(proposal)
+            prompt, risks = self._build_ranking_prompt(proposal_text, risks)
             
-            # Generate response
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=self.temperature,
-                    max_output_tokens=config.LLM_MAX_TOKENS,
-                    response_mime_type="application/json"
-                )
-            )
+            if use_cache:
+                cached = await self._get_cached_ranking(prompt, risks)
+                if cached:
+                    for ranked in cached.risks:
+                        yield ranked
+                    return
             
-            # Parse JSON response
-            result_data = json.loads(response.text)
+            logger.info(f"Ranking {len(risks)} candidate risks (streamed)")
             
-            # Validate response structure
-            if "risks" not in result_data:
-                raise ValueError("Invalid response format from LLM")
+            parser = _RankedRiskParser()
+            items = asyncio.Queue()
+            # Read on a separate task so a slow consumer never keeps a slot
+            reader = asyncio.create_task(self._read_ranking_stream(prompt, parser, items, slots))
+            try:
+                valid_ids = {r.risk_id for r in risks}
+                while (item := await items.get()) is not None:
+                    try:
+                        ranked = RankedRisk.model_validate(item)
+                    except ValidationError as e:
+                        logger.error(f"Invalid LLM response: {e}")
+                        raise ValueError("Invalid response format from LLM")
+                    if ranked.risk_id not in valid_ids:
+                        raise ValueError(f"LLM selected invalid risk_id: {ranked.risk_id}")
+                    yield ranked.model_dump()
+                # Raises whatever ended the stream early
+                await reader
+            finally:
+                reader.cancel()
             
-            ranked_risks = result_data["risks"]
+            result = self._parse_ranking_response(parser.text, risks)
+            if use_cache:
+                await self._set_cached(RANKING_CACHE_NAMESPACE, prompt, result)
             
-            # Validate we got exactly 3 risks
-            if len(ranked_risks) != config.TOP_N_RISKS:
-                raise ValueError(f"Expected {config.TOP_N_RISKS} risks, got {len(ranked_risks)}")
+        except Exception as e:
+            logger.error(f"Error ranking risks: {e}")
+            raise
+    
+    async def _read_ranking_stream(self, prompt: str, parser: _RankedRiskParser, items: asyncio.Queue,
+                                   slots: Optional[asyncio.Semaphore]):
+        """Feed a streamed ranking response through parser, queueing each risk and then None"""
+        try:
+            async with slots or nullcontext():
+                response = await self.model.generate_content_async(
+                    prompt, generation_config=self._json_generation_config(RANKING_RESPONSE_SCHEMA), stream=True
+                )
+                async for chunk in response:
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks carrying no text part, such as a final finish_reason-only one
+                        continue
+                    for item in parser.feed(text):
+                        items.put_nowait(item)
+        finally:
+            items.put_nowait(None)
+    
+    async def rank_and_select_many_async(self, proposals: List[Union[ProposalSchema, str]], risks: List[Risk],
+                                         use_cache: bool = True,
+                                         slots: Optional[asyncio.Semaphore] = None) -> List[RiskRankingResult]:
+        """
+        Stage 2 for several proposals that share one candidate list
+        
+        Proposals missing from the cache are ranked together in a single
+        prompt, so the instructions and candidate block are sent once. If
+        the combined response can't be used, each proposal is ranked on
+        its own instead.
+        
+        Args:
+            proposals: Proposals to assess (at most RANKING_BATCH_SIZE), or their texts
+            risks: Candidate risks shared by every proposal
+            use_cache: Reuse rankings for identical prompts
+            slots: Held for each Gemini request made, so callers can bound
+                concurrency per request rather than per call
             
-            # Validate each risk has required fields
-            for risk in ranked_risks:
-                if "risk_id" not in risk or "reasoning" not in risk:
-                    raise ValueError("Invalid risk format in LLM response")
-                
-                # Validate risk_id exists in candidate risks
-                risk_id = risk["risk_id"]
-                if not any(r.risk_id == risk_id for r in risks):
-                    raise ValueError(f"LLM selected invalid risk_id: {risk_id}")
+        Returns:
+            RiskRankingResult per proposal, in the same order as proposals
+        """
+        proposal_texts = [self._proposal_text(p) for p in proposals]
+        risks = self._limit_candidates(
+            risks, len(format_risk_ranking_batch_prompt(format_batch_proposals(proposal_texts), ""))
+        )
+        # Format the shared candidate block once for every prompt below
+        candidate_risks_text = format_candidate_risks(risks)
+        prompts = [format_risk_ranking_prompt(text, candidate_risks_text) for text in proposal_texts]
+        
+        results = [None] * len(proposals)
+        if use_cache:
+            for i, prompt in enumerate(prompts):
+                results[i] = await self._get_cached_ranking(prompt, risks)
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        if len(pending) == 1:
+            i = pending[0]
+            results[i] = await self._rank(prompts[i], risks, use_cache, slots)
+            return results
+        
+        try:
+            prompt = format_risk_ranking_batch_prompt(
+                format_batch_proposals([proposal_texts[i] for i in pending]),
+                candidate_risks_text
+            )
             
-            logger.info(f"Successfully ranked risks: {[r['risk_id'] for r in ranked_risks]}")
+            logger.info(f"Ranking {len(risks)} candidate risks for {len(pending)} proposals in one request")
             
-            return RiskRankingResult(risks=ranked_risks)
+            # Generate response
+            async with slots or nullcontext():
+                response = await self.model.generate_content_async(
+                    prompt, generation_config=self._json_generation_config(
+                        RANKING_BATCH_RESPONSE_SCHEMA, config.RANKING_BATCH_MAX_TOKENS
+                    )
+                )
+            
+            ranked = self._parse_ranking_batch_response(response, risks, len(pending))
             
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse LLM response as JSON: {e}")
-            logger.error(f"Raw response: {response.text}")
-            raise Exception("Invalid JSON response from LLM")
         except Exception as e:
-            logger.error(f"Error ranking risks: {e}")
-            raise
+            logger.warning(f"Batch ranking failed, ranking proposals individually: {e}")
+            # Already missed the cache above, so go straight to Gemini
+            ranked = await asyncio.gather(*(
+                self._rank(prompts[i], risks, use_cache, slots) for i in pending
+            ))
+        else:
+            if use_cache:
+                for i, result in zip(pending, ranked):
+                    await self._set_cached(RANKING_CACHE_NAMESPACE, prompts[i], result)
+        
+        for i, result in zip(pending, ranked):
+            results[i] = result
+        return results
     
-    def _format_proposal_text(self, proposal: Dict[str, Any]) -> str:
-        """Format proposal dictionary into readable text"""
-        parts = []
+    async def _rank(self, prompt: str, risks: List[Risk], use_cache: bool,
+                    slots: Optional[asyncio.Semaphore] = None) -> RiskRankingResult:
+        """Rank one proposal's prompt with Gemini, caching but not consulting the cache"""
+        logger.info(f"Ranking {len(risks)} candidate risks")
         
-        if proposal.get("proposal_title"):
-            parts.append(f"Title: {proposal['proposal_title']}")
+        # Generate response
+        async with slots or nullcontext():
+            response = await self.model.generate_content_async(
+                prompt, generation_config=self._json_generation_config(RANKING_RESPONSE_SCHEMA)
+            )
         
-        if proposal.get("description"):
-            parts.append(f"Description: {proposal['description']}")
+        result = self._parse_ranking_response(response.text, risks)
+        if use_cache:
+            await self._set_cached(RANKING_CACHE_NAMESPACE, prompt, result)
+        return result
+    
+    def _json_generation_config(self, schema: genai.protos.Schema,
+                                max_tokens: int = None) -> genai.types.GenerationConfig:
+        """Generation config for stages whose output is constrained to a JSON schema"""
+        return genai.types.GenerationConfig(
+            temperature=self.temperature,
+            max_output_tokens=max_tokens or config.LLM_MAX_TOKENS,
+            response_mime_type="application/json",
+            response_schema=schema
+        )
+    
+    async def _get_cached(self, namespace: str, prompt: str, result_type: Type[ResultT]) -> Optional[ResultT]:
+        """Look up a cached stage result, keyed on the full prompt"""
+        if self.cache is None:
+            return None
         
-        if proposal.get("technical_approach"):
-            parts.append(f"Technical Approach: {proposal['technical_approach']}")
+        try:
+            payload = await self.cache.aget(namespace, self._prompt_key(prompt))
+            return result_type.model_validate_json(payload) if payload else None
+        except Exception as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+    
+    async def _get_cached_ranking(self, prompt: str, risks: List[Risk]) -> Optional[RiskRankingResult]:
+        """Cached ranking, provided every risk it selected is still a candidate"""
+        cached = await self._get_cached(RANKING_CACHE_NAMESPACE, prompt, RiskRankingResult)
+        if cached is None:
+            return None
         
-        if proposal.get("data_sources"):
-            sources = proposal["data_sources"]
-            if isinstance(sources, list):
-                parts.append(f"Data Sources: {', '.join(sources)}")
-            else:
-                parts.append(f"Data Sources: {sources}")
+        candidate_ids = {r.risk_id for r in risks}
+        if not all(ranked["risk_id"] in candidate_ids for ranked in cached.risks):
+            logger.info("Cached ranking selects risks outside the current candidates, ignoring it")
+            return None
+        return cached
+    
+    async def _set_cached(self, namespace: str, prompt: str, result: BaseModel):
+        """Store a stage result in the cache"""
+        if self.cache is None:
+            return
         
-        if proposal.get("deployment"):
-            parts.append(f"Deployment: {proposal['deployment']}")
+        try:
+            await self.cache.aset(namespace, self._prompt_key(prompt), result.model_dump_json())
+        except Exception as e:
+            logger.warning(f"LLM cache store failed: {e}")
+    
+    def _prompt_key(self, prompt: str) -> str:
+        """Exact-match cache key for a prompt"""
+        return hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+    
+    def _build_keyword_prompt(self, proposal_text: str) -> str:
+        """Create the Stage 1 prompt for a formatted proposal"""
+        return format_keyword_extraction_prompt(proposal_text)
+    
+    def _parse_keyword_response(self, response) -> KeywordExtractionResult:
+        """Parse and validate the Stage 1 LLM response"""
+        try:
+            # The schema constrains decoding; this is only a cheap guard
+            result_data = LLMKeywordResponse.model_validate_json(response.text)
+        except ValidationError as e:
+            logger.error(f"Invalid LLM response: {e}")
+            logger.error(f"Raw response: {response.text}")
+            raise ValueError("Invalid response format from LLM")
         
-        if proposal.get("data_governance"):
-            parts.append(f"Data Governance: {proposal['data_governance']}")
+        logger.info(f"Extracted keywords: {result_data.keywords} (confidence: {result_data.confidence})")
         
-        if proposal.get("model_governance"):
-            parts.append(f"Model Governance: {proposal['model_governance']}")
+        return KeywordExtractionResult(
+            keywords=result_data.keywords,
+            confidence=result_data.confidence
+        )
+    
+    def _limit_candidates(self, risks: List[Risk], prompt_chars: int) -> List[Risk]:
+        """
+        Limit candidate risks to prevent context overflow
+        
+        Beyond the MAX_CANDIDATE_RISKS cap, trailing (least relevant)
+        candidates are dropped until the prompt fits MAX_INPUT_TOKENS, so an
+        oversized request fails here rather than after a Gemini round-trip.
+        Tokens are estimated as characters / 4.
+        
+        Args:
+            risks: Candidate risks, most relevant first
+            prompt_chars: Length of the prompt without its candidate block
+        """
+        if len(risks) > config.MAX_CANDIDATE_RISKS:
+            risks = risks[:config.MAX_CANDIDATE_RISKS]
+            logger.warning(f"Limited candidate risks to {config.MAX_CANDIDATE_RISKS}")
+        
+        budget = MAX_INPUT_TOKENS * 4 - prompt_chars
+        used = 0
+        for count, risk in enumerate(risks):
+            # Each entry plus the newline joining it to the next
+            used += len(format_candidate_risks([risk])) + 1
+            if used > budget:
+                if count == 0:
+                    raise ValueError("Proposal is too long to rank within the model context")
+                logger.warning(f"Dropped {len(risks) - count} candidate risks to fit {MAX_INPUT_TOKENS} input tokens")
+                return risks[:count]
+        
+        return risks
+    
+    def _build_ranking_prompt(self, proposal_text: str, risks: List[Risk]) -> Tuple[str, List[Risk]]:
+        """Create the Stage 2 prompt, returning it with the candidate risks it includes"""
+        risks = self._limit_candidates(risks, len(format_risk_ranking_prompt(proposal_text, "")))
+        
+        # Format candidate risks
+        candidate_risks_text = format_candidate_risks(risks)
+        
+        # Create prompt
+        return format_risk_ranking_prompt(proposal_text, candidate_risks_text), risks
+    
+    def _parse_ranking_response(self, text: str, risks: List[Risk]) -> RiskRankingResult:
+        """Parse and validate the Stage 2 LLM response text against the candidate risks"""
+        try:
+            # The schema constrains decoding; this is only a cheap guard
+            result_data = LLMRankResponse.model_validate_json(text)
+        except ValidationError as e:
+            logger.error(f"Invalid LLM response: {e}")
+            logger.error(f"Raw response: {text}")
+            raise ValueError("Invalid response format from LLM")
+        
+        return self._check_ranking(result_data.risks, risks)
+    
+    def _parse_ranking_batch_response(self, response, risks: List[Risk], count: int) -> List[RiskRankingResult]:
+        """Parse a multi-proposal Stage 2 response into one ranking per proposal, in prompt order"""
+        try:
+            result_data = LLMRankBatchResponse.model_validate_json(response.text)
+        except ValidationError as e:
+            logger.error(f"Invalid LLM response: {e}")
+            logger.error(f"Raw response: {response.text}")
+            raise ValueError("Invalid response format from LLM")
+        
+        by_id = {ranking.proposal_id: ranking for ranking in result_data.results}
+        expected_ids = [f"P{i}" for i in range(1, count + 1)]
+        missing = [pid for pid in expected_ids if pid not in by_id]
+        if missing:
+            raise ValueError(f"LLM response is missing proposals: {missing}")
+        
+        return [self._check_ranking(by_id[pid].risks, risks) for pid in expected_ids]
+    
+    def _check_ranking(self, ranked: List[RankedRisk], risks: List[Risk]) -> RiskRankingResult:
+        """Ensure every ranked risk is one of the candidates"""
+        ranked_risks = [risk.model_dump() for risk in ranked]
+        
+        # Validate each risk_id exists in candidate risks
+        valid_ids = {r.risk_id for r in risks}
+        for risk in ranked_risks:
+            if risk["risk_id"] not in valid_ids:
+                raise ValueError(f"LLM selected invalid risk_id: {risk['risk_id']}")
         
-        if proposal.get("security_measures"):
-            parts.append(f"Security Measures: {proposal['security_measures']}")
+        logger.info(f"Successfully ranked risks: {[r['risk_id'] for r in ranked_risks]}")
+        
+        return RiskRankingResult(risks=ranked_risks)
+    
+    def _proposal_text(self, proposal: Union[ProposalSchema, str]) -> str:
+        """Accept either a proposal or text already formatted by the caller"""
+        return proposal if isinstance(proposal, str) else self.format_proposal_text(proposal)
+    
+    def format_proposal_text(self, proposal: ProposalSchema) -> str:
+        """
+        Format proposal into readable text
+        
+        Callers running several stages for one proposal can format it once
+        and pass the text to each stage instead.
+        """
+        parts = [
+            f"{label}: {', '.join(value) if key == 'data_sources' else value}"
+            for key, label in _PROPOSAL_FIELDS
+            if (value := getattr(proposal, key))
+        ]
         
         # Add any additional fields
-        if proposal.get("additional_fields"):
-            for key, value in proposal["additional_fields"].items():
-                parts.append(f"{key}: {value}")
+        if proposal.additional_fields:
+            parts.extend(f"{key}: {value}" for key, value in proposal.additional_fields.items())
         
         return "\n\n".join(parts)
     
-    def health_check(self) -> bool:
-        """Check if Gemini API is accessible"""
+    async def health_check_async(self) -> bool:
+        """Check if Gemini API is accessible, reusing a result up to HEALTH_CHECK_TTL old"""
+        return await self._health.get()
+    
+    async def _probe_health(self) -> bool:
+        """Send Gemini a minimal request"""
         try:
             # Simple test request
-            response = self.model.generate_content(
+            response = await self.model.generate_content_async(
                 "Say 'OK' if you can respond",
                 generation_config=genai.types.GenerationConfig(
                     temperature=0,
@@ -1,10 +1,12 @@
 # Risk Assessment Engine Models
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 import uuid
 
+import config
+
 class Control(BaseModel):
     """Control model"""
     control_id: str = Field(..., description="Control ID (e.g., C.AIIM.1)")
@@ -30,14 +32,11 @@ class RiskAssessmentResult(BaseModel):
     assessment_id: str = Field(default_factory=lambda: str(uuid.uuid4()), description="Unique assessment ID")
     timestamp: datetime = Field(default_factory=datetime.now, description="Assessment timestamp")
     risks: List[RiskAssessment] = Field(..., description="Top 3 identified risks")
-    
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
 
 class ProposalSchema(BaseModel):
     """Proposal input schema"""
+    model_config = ConfigDict(extra='ignore')
+    
     cfp_id: Optional[str] = Field(None, description="CFP ID")
     proposal_title: Optional[str] = Field(None, description="Proposal title")
     description: str = Field(..., description="Proposal description")
@@ -50,11 +49,20 @@ class ProposalSchema(BaseModel):
     
     # Additional fields for flexibility
     additional_fields: Optional[Dict[str, Any]] = Field(None, description="Additional proposal fields")
+    
+    @field_validator('data_sources', mode='before')
+    @classmethod
+    def _single_data_source(cls, value):
+        """Accept a single data source given as a plain string"""
+        return [value] if isinstance(value, str) else value
 
 class AssessmentRequest(BaseModel):
     """Assessment request schema"""
+    model_config = ConfigDict(extra='ignore')
+    
     proposal: ProposalSchema = Field(..., description="Proposal to assess")
     cfp: Optional[Dict[str, Any]] = Field(None, description="Optional CFP context")
+    no_cache: bool = Field(False, description="Bypass the response cache")
 
 class KeywordExtractionResult(BaseModel):
     """Result from keyword extraction stage"""
@@ -65,3 +73,29 @@ class RiskRankingResult(BaseModel):
     """Result from risk ranking stage"""
     risks: List[Dict[str, str]] = Field(..., description="Ranked risks with reasoning")
     # Format: [{"risk_id": "R.AIR.001", "reasoning": "..."}, ...]
+
+# Raw LLM response schemas, validated straight from the response JSON
+
+class LLMKeywordResponse(BaseModel):
+    """Stage 1 response as returned by the LLM"""
+    keywords: List[str] = Field(..., min_length=1, description="Extracted risk keywords")
+    confidence: float = Field(..., description="Confidence score (0-1)")
+
+class RankedRisk(BaseModel):
+    """One risk selected by the LLM"""
+    risk_id: str = Field(..., description="Risk ID from the candidate list")
+    reasoning: str = Field(..., description="Why this risk applies")
+
+class LLMRankResponse(BaseModel):
+    """Stage 2 response as returned by the LLM"""
+    risks: List[RankedRisk] = Field(
+        ..., min_length=config.TOP_N_RISKS, max_length=config.TOP_N_RISKS, description="Selected risks"
+    )
+
+class LLMBatchRanking(LLMRankResponse):
+    """Selected risks for one proposal of a batch ranking"""
+    proposal_id: str = Field(..., description="Proposal ID from the batch prompt (e.g., P1)")
+
+class LLMRankBatchResponse(BaseModel):
+    """Multi-proposal Stage 2 response as returned by the LLM"""
+    results: List[LLMBatchRanking] = Field(..., description="One ranking per proposal")
@@ -1,5 +1,10 @@
 # Risk Assessment Prompt Templates
 
+from typing import List
+
+from models import Risk
+import config
+
 KEYWORD_EXTRACTION_PROMPT = """
 You are an AI/ML security risk assessor. Your task is to analyze a proposal and extract key risk themes that would be relevant for AI/ML security assessment.
 
@@ -77,24 +82,105 @@ Return ONLY a JSON object with this exact format:
 CRITICAL: Return ONLY valid JSON. No additional text or explanation.
 """
 
+RISK_RANKING_BATCH_PROMPT = """
+You are an AI/ML security risk assessor. Your task is to analyze several proposals and, for each one, select the top 3 most relevant risks from a shared list of candidate risks.
+
+PROPOSALS:
+{proposals}
+
+CANDIDATE RISKS:
+{candidate_risks}
+
+INSTRUCTIONS:
+1. Assess each proposal independently - details of one proposal must not influence another
+2. Analyze the proposal's AI/ML use case, data sources, deployment approach, and security measures
+3. For each candidate risk, assess how relevant it is to the proposal
+4. Consider the likelihood and impact of each risk for that use case
+5. Select the TOP 3 most relevant risks for each proposal
+6. For each selected risk, provide a clear explanation of why it applies
+
+CRITICAL CONSTRAINTS:
+- Return exactly one result per proposal, identified by its PROPOSAL ID
+- You MUST select exactly 3 risks for each proposal
+- You MUST only select from the candidate risks list above
+- Risk IDs must match exactly (e.g., "R.AIR.001")
+- Provide substantive explanations (at least 2 sentences each)
+
+Return ONLY a JSON object with this exact format:
+{{
+  "results": [
+    {{
+      "proposal_id": "P1",
+      "risks": [
+        {{
+          "risk_id": "R.AIR.XXX",
+          "reasoning": "Detailed explanation of why this risk applies to proposal P1..."
+        }},
+        {{
+          "risk_id": "R.AIR.YYY",
+          "reasoning": "Detailed explanation of why this risk applies to proposal P1..."
+        }},
+        {{
+          "risk_id": "R.AIR.ZZZ",
+          "reasoning": "Detailed explanation of why this risk applies to proposal P1..."
+        }}
+      ]
+    }}
+  ]
+}}
+
+CRITICAL: Return ONLY valid JSON. No additional text or explanation.
+"""
+
+def _split_template(template: str, *fields: str) -> List[str]:
+    """
+    Split a str.format template into the static text around its placeholders
+    
+    Done once at import so each request only concatenates the variable
+    parts, instead of re-parsing the whole template with str.format.
+    """
+    return template.format(**{field: "\0" for field in fields}).split("\0")
+
+_KEYWORD_HEADER, _KEYWORD_FOOTER = _split_template(KEYWORD_EXTRACTION_PROMPT, "proposal_text")
+_RANKING_HEADER, _RANKING_MID, _RANKING_FOOTER = _split_template(
+    RISK_RANKING_PROMPT, "proposal_text", "candidate_risks"
+)
+_BATCH_RANKING_HEADER, _BATCH_RANKING_MID, _BATCH_RANKING_FOOTER = _split_template(
+    RISK_RANKING_BATCH_PROMPT, "proposals", "candidate_risks"
+)
+
 def format_keyword_extraction_prompt(proposal_text: str) -> str:
     """Format the keyword extraction prompt with proposal text"""
-    return KEYWORD_EXTRACTION_PROMPT.format(proposal_text=proposal_text)
+    return _KEYWORD_HEADER + proposal_text + _KEYWORD_FOOTER
 
 def format_risk_ranking_prompt(proposal_text: str, candidate_risks: str) -> str:
     """Format the risk ranking prompt with proposal text and candidate risks"""
-    return RISK_RANKING_PROMPT.format(
-        proposal_text=proposal_text,
-        candidate_risks=candidate_risks
+    return _RANKING_HEADER + proposal_text + _RANKING_MID + candidate_risks + _RANKING_FOOTER
+
+def format_risk_ranking_batch_prompt(proposals: str, candidate_risks: str) -> str:
+    """Format the multi-proposal ranking prompt with proposals and shared candidate risks"""
+    return _BATCH_RANKING_HEADER + proposals + _BATCH_RANKING_MID + candidate_risks + _BATCH_RANKING_FOOTER
+
+def format_batch_proposals(proposal_texts: List[str]) -> str:
+    """Format proposal texts for the batch prompt, with IDs P1, P2, ..."""
+    return "\n".join(
+        "PROPOSAL ID: P" + str(i) + "\n" + text + "\n" for i, text in enumerate(proposal_texts, 1)
     )
 
-def format_candidate_risks(risks: list) -> str:
-    """Format candidate risks for the prompt"""
-    formatted_risks = []
-    for risk in risks:
-        formatted_risks.append(
-            f"ID: {risk['risk_id']}\n"
-            f"Title: {risk['risk_title']}\n"
-            f"Description: {risk['risk_description']}\n"
-        )
-    return "\n".join(formatted_risks)
+def _truncate(text: str, limit: int) -> str:
+    """Shorten text to at most limit characters, marking the cut"""
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+def format_candidate_risks(risks: List[Risk]) -> str:
+    """
+    Format candidate Risk objects for the prompt
+    
+    Descriptions are cut to PROMPT_RISK_DESCRIPTION_CHARS to save input
+    tokens; results are built from the full risk details, not the prompt.
+    """
+    limit = config.PROMPT_RISK_DESCRIPTION_CHARS
+    return "\n".join(
+        "ID: " + risk.risk_id + "\nTitle: " + risk.risk_title
+        + "\nDescription: " + _truncate(risk.risk_description, limit) + "\n"
+        for risk in risks
+    )
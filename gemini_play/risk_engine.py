@@ -1,96 +1,312 @@
 # Risk Assessment Engine
 
+import asyncio
 import logging
-from typing import Dict, Any, List
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, AsyncIterator, Union
 
 from models import RiskAssessmentResult, RiskAssessment, Control, ProposalSchema
 from db_service import DatabaseServiceClient
-from llm_service import GeminiLLMService
+from llm_service import GeminiLLMService, get_llm_service
+from cache import ResponseCache, fingerprint
 import config
 
 logger = logging.getLogger(__name__)
 
+class _AssessmentBatch:
+    """
+    Coalesces the database and Stage 3 ranking calls of one assess_proposals_batch call
+    
+    Proposals that extract the same keyword share its risk search. Every
+    proposal then either submits its ranking or leaves without one (cache
+    hit or earlier failure). Once all have done one or the other,
+    proposals with identical candidate sets are ranked together,
+    RANKING_BATCH_SIZE per Gemini request, while controls for every
+    submitted candidate are fetched in a single request.
+    
+    If any proposal is cancelled the batch is torn down instead: nothing
+    more is dispatched, and rankings still queued are cancelled.
+    """
+    
+    def __init__(self, engine: "RiskAssessmentEngine", size: int):
+        self.engine = engine
+        self.waiting = size
+        self.requests = []
+        self.searches = {}
+        self.controls = asyncio.get_running_loop().create_future()
+        self.dispatch_task = None
+        self.cancelled = False
+    
+    async def search_risks(self, keywords: List[str]) -> List:
+        """Search risks like DatabaseServiceClient.search_risks, running each keyword's search once per batch"""
+        searches = []
+        for keyword in keywords[:config.SEARCH_KEYWORD_LIMIT]:
+            if keyword not in self.searches:
+                self.searches[keyword] = asyncio.create_task(self.engine.db_client.search_risks([keyword]))
+            searches.append(self.searches[keyword])
+        
+        # Shielded so one proposal giving up doesn't cancel a search others await
+        results = await asyncio.gather(*(asyncio.shield(search) for search in searches))
+        
+        # Merge in keyword order, dropping duplicates
+        risks = {}
+        for found in results:
+            for risk in found:
+                risks.setdefault(risk.risk_id, risk)
+        return list(risks.values())
+    
+    async def prefetch_controls(self) -> Optional[Dict[str, List[Control]]]:
+        """Controls for every submitted candidate, once dispatch has fetched them"""
+        return await asyncio.shield(self.controls)
+    
+    def submit(self, proposal_text: str, candidate_risks: List, use_cache: bool) -> asyncio.Future:
+        """Queue a ranking, returning a future for its result"""
+        future = asyncio.get_running_loop().create_future()
+        self.requests.append((proposal_text, candidate_risks, use_cache, future))
+        self.leave()
+        return future
+    
+    def leave(self):
+        """Mark one proposal as done submitting; dispatch once none are left"""
+        self.waiting -= 1
+        if self.waiting == 0:
+            if self.cancelled:
+                self.abandon()
+            else:
+                self.dispatch_task = asyncio.create_task(self.dispatch())
+    
+    def abandon(self):
+        """Cancel whatever the batch still owes its proposals"""
+        for _, _, _, future in self.requests:
+            future.cancel()
+        if not self.controls.done():
+            self.controls.set_result(None)
+    
+    async def aclose(self):
+        """Stop a dispatch still in flight once the batch's proposals are done with it"""
+        if self.dispatch_task is not None and not self.dispatch_task.done():
+            self.dispatch_task.cancel()
+            await asyncio.gather(self.dispatch_task, return_exceptions=True)
+        self.abandon()
+    
+    async def dispatch(self):
+        """Rank the queued proposals, grouped by candidate set"""
+        groups = {}
+        for request in self.requests:
+            _, candidate_risks, use_cache, _ = request
+            key = (frozenset(r.risk_id for r in candidate_risks), use_cache)
+            groups.setdefault(key, []).append(request)
+        
+        chunks = [
+            group[i:i + config.RANKING_BATCH_SIZE]
+            for group in groups.values()
+            for i in range(0, len(group), config.RANKING_BATCH_SIZE)
+        ]
+        await asyncio.gather(self.fetch_controls(), *(self.rank_chunk(chunk) for chunk in chunks))
+    
+    async def fetch_controls(self):
+        """Fetch controls for the union of the queued proposals' candidates"""
+        candidate_ids = list(dict.fromkeys(
+            r.risk_id
+            for _, candidate_risks, _, _ in self.requests
+            for r in candidate_risks[:config.MAX_CANDIDATE_RISKS]
+        ))
+        
+        controls = None
+        if candidate_ids:
+            try:
+                controls = await self.engine.db_client.get_controls_for_risks(candidate_ids)
+            except Exception as e:
+                logger.warning(f"Batch control prefetch failed, fetching after ranking instead: {e}")
+        self.controls.set_result(controls)
+    
+    async def rank_chunk(self, chunk: List):
+        """Rank one chunk of proposals that share a candidate set"""
+        _, candidate_risks, use_cache, _ = chunk[0]
+        llm_service = self.engine.llm_service
+        
+        try:
+            if len(chunk) == 1:
+                results = [await self.engine._call_llm(
+                    llm_service.rank_and_select_async(chunk[0][0], candidate_risks, use_cache)
+                )]
+            else:
+                # Takes a slot per Gemini request itself, so a fallback to
+                # individual rankings stays within MAX_CONCURRENT_LLM
+                results = await llm_service.rank_and_select_many_async(
+                    [proposal_text for proposal_text, _, _, _ in chunk], candidate_risks, use_cache,
+                    self.engine._llm_slots
+                )
+        except Exception as e:
+            for _, _, _, future in chunk:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, _, _, future), result in zip(chunk, results):
+            if not future.done():
+                future.set_result(result)
+
+class _BatchMember:
+    """One proposal's view of its _AssessmentBatch"""
+    
+    def __init__(self, batch: _AssessmentBatch):
+        self.batch = batch
+        self.done = False
+    
+    async def rank(self, proposal_text: str, candidate_risks: List, use_cache: bool):
+        """Submit this proposal's ranking to the batch and wait for it"""
+        self.done = True
+        return await self.batch.submit(proposal_text, candidate_risks, use_cache)
+    
+    def leave(self):
+        """Release the batch if this proposal never submitted a ranking"""
+        if not self.done:
+            self.done = True
+            self.batch.leave()
+
+# Set while a proposal is being assessed as part of assess_proposals_batch
+_batch_member: ContextVar[Optional[_BatchMember]] = ContextVar("batch_member", default=None)
+
 class RiskAssessmentEngine:
     """Orchestrates two-stage assessment"""
     
-    def __init__(self, db_client: DatabaseServiceClient = None, llm_service: GeminiLLMService = None):
+    def __init__(self, db_client: DatabaseServiceClient = None, llm_service: GeminiLLMService = None,
+                 cache: Union[ResponseCache, bool] = None):
         self.db_client = db_client or DatabaseServiceClient()
-        self.llm_service = llm_service or GeminiLLMService()
+        self.llm_service = llm_service or get_llm_service()
+        # cache=False turns the response cache off regardless of CACHE_ENABLED
+        if isinstance(cache, ResponseCache):
+            self.cache = cache
+        elif cache is False or not config.CACHE_ENABLED:
+            self.cache = None
+        else:
+            self.cache = ResponseCache()
+        # Bounds Gemini calls across all concurrent assessments, batches included
+        self._llm_slots = asyncio.Semaphore(config.MAX_CONCURRENT_LLM)
         
         logger.info("Risk Assessment Engine initialized")
     
-    def assess_proposal(self, proposal: Dict[str, Any]) -> RiskAssessmentResult:
+    async def assess_proposal(self, proposal: Union[ProposalSchema, Dict[str, Any]],
+                              cfp: Optional[Dict[str, Any]] = None,
+                              use_cache: bool = True) -> RiskAssessmentResult:
         """
         Complete risk assessment workflow
         
         Args:
-            proposal: Proposal dictionary with description and other fields
+            proposal: Proposal model, or a dictionary with description and other fields
+            cfp: Optional CFP context
+            use_cache: Serve and store results via the response cache
             
         Returns:
             RiskAssessmentResult with top 3 risks, explanations, and controls
         """
+        result = None
+        async for event in self.assess_proposal_stream(proposal, cfp, use_cache):
+            if event["event"] == "result":
+                result = event["result"]
+        return result
+    
+    async def assess_proposal_stream(self, proposal: Union[ProposalSchema, Dict[str, Any]],
+                                     cfp: Optional[Dict[str, Any]] = None,
+                                     use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Risk assessment workflow that yields progress events as stages complete
+        
+        Events, in order:
+            {"event": "keywords", "keywords": [...], "confidence": 0.85}
+            {"event": "candidates", "count": 24}
+            {"event": "risk", "risk": RiskAssessment}  (one per assessed risk, as Gemini ranks it)
+            {"event": "error", "message": "..."}  (only if the assessment failed)
+            {"event": "result", "result": RiskAssessmentResult, "cached": False}
+        
+        A cache hit yields only the final result event.
+        """
+        try:
+            proposal = self._as_proposal(proposal)
+        except Exception as e:
+            logger.error(f"Risk assessment failed: {e}")
+            yield {"event": "error", "message": str(e)}
+            yield {"event": "result", "result": self._error_result(e), "cached": False}
+            return
+        
+        use_response_cache = use_cache and self.cache is not None
+        
+        if use_response_cache:
+            cached_result = await self._get_cached_result(proposal, cfp)
+            if cached_result:
+                yield {"event": "result", "result": cached_result, "cached": True}
+                return
+        
+        async for event in self._assessment_events(proposal, use_cache):
+            if event["event"] == "result" and use_response_cache:
+                await self._cache_result(proposal, cfp, event["result"])
+            yield event
+    
+    async def _assessment_events(self, proposal: ProposalSchema,
+                                 use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """Run the full assessment pipeline without consulting the response cache"""
         try:
             logger.info("Starting risk assessment")
             
+            # Both LLM stages prompt with the same text, so format it once
+            proposal_text = self.llm_service.format_proposal_text(proposal)
+            
             # Stage 1: Extract keywords via LLM
             logger.info("Stage 1: Extracting keywords")
-            keyword_result = self.llm_service.extract_keywords(proposal)
+            keyword_result = await self._call_llm(self.llm_service.extract_keywords_async(proposal_text, use_cache))
             keywords = keyword_result.keywords
+            yield {"event": "keywords", "keywords": keywords, "confidence": keyword_result.confidence}
             
             # Stage 2: Query database-service with keywords
             logger.info("Stage 2: Querying database for relevant risks")
-            candidate_risks = self.db_client.search_risks(keywords)
+            candidate_risks = await self._search_risks(keywords)
             
             if not candidate_risks:
                 logger.warning("No risks found for keywords, using fallback")
                 # Fallback: get some general risks
-                candidate_risks = self._get_fallback_risks()
+                candidate_risks = await self._get_fallback_risks()
+            yield {"event": "candidates", "count": len(candidate_risks)}
             
-            # Stage 3: Rank via LLM
+            # Stage 3: Rank via LLM, prefetching controls for the candidates meanwhile
             logger.info("Stage 3: Ranking risks with LLM")
-            ranking_result = self.llm_service.rank_and_select(proposal, candidate_risks)
+            controls_task = self._start_control_prefetch(candidate_risks)
+            assessments = []
+            risk_by_id = {r.risk_id: r for r in candidate_risks}
             
-            # Stage 4: Enrich with controls
-            logger.info("Stage 4: Enriching with controls")
-            risk_ids = [r["risk_id"] for r in ranking_result.risks]
-            controls_by_risk = self.db_client.get_controls_for_risks(risk_ids)
+            try:
+                # Stage 4: Enrich each ranked risk with controls as it arrives
+                async for ranked_risk in self._ranked_risks(proposal_text, candidate_risks, use_cache):
+                    risk_id = ranked_risk["risk_id"]
+                    reasoning = ranked_risk["reasoning"]
+                    
+                    # Find the full risk details
+                    risk_details = risk_by_id.get(risk_id)
+                    
+                    if not risk_details:
+                        logger.error(f"Could not find details for risk {risk_id}")
+                        continue
+                    
+                    # Get controls for this risk
+                    controls = await self._controls_for(risk_id, controls_task)
+                    
+                    # Create assessment
+                    assessment = RiskAssessment(
+                        risk_id=risk_id,
+                        risk_title=risk_details.risk_title,
+                        risk_description=risk_details.risk_description,
+                        explanation=reasoning,
+                        controls=controls
+                    )
+                    
+                    assessments.append(assessment)
+                    yield {"event": "risk", "risk": assessment}
+            finally:
+                # Only still running if ranking failed; its controls aren't needed
+                controls_task.cancel()
             
             # Stage 5: Build final result
             logger.info("Stage 5: Building assessment result")
-            assessments = []
-            
-            for ranked_risk in ranking_result.risks:
-                risk_id = ranked_risk["risk_id"]
-                reasoning = ranked_risk["reasoning"]
-                
-                # Find the full risk details
-                risk_details = None
-                for risk in candidate_risks:
-                    if risk.risk_id == risk_id:
-                        risk_details = risk
-                        break
-                
-                if not risk_details:
-                    logger.error(f"Could not find details for risk {risk_id}")
-                    continue
-                
-                # Get controls for this risk
-                controls = controls_by_risk.get(risk_id, [])
-                
-                # Create assessment
-                assessment = RiskAssessment(
-                    risk_id=risk_id,
-                    risk_title=risk_details.risk_title,
-                    risk_description=risk_details.risk_description,
-                    explanation=reasoning,
-                    controls=controls
-                )
-                
-                assessments.append(assessment)
             
             # Ensure we have exactly 3 assessments
             if len(assessments) != config.TOP_N_RISKS:
@@ -108,37 +324,215 @@ class RiskAssessmentEngine:
             result = RiskAssessmentResult(risks=assessments)
             
             logger.info(f"Risk assessment completed: {len(assessments)} risks identified")
-            return result
             
         except Exception as e:
             logger.error(f"Risk assessment failed: {e}")
-            # Return error result
-            error_assessments = [
-                RiskAssessment(
-                    risk_id="ERROR",
-                    risk_title="Assessment Error",
-                    risk_description="An error occurred during risk assessment",
-                    explanation=f"Error: {str(e)}",
-                    controls=[]
-                )
-                for _ in range(config.TOP_N_RISKS)
-            ]
-            return RiskAssessmentResult(risks=error_assessments)
+            yield {"event": "error", "message": str(e)}
+            result = self._error_result(e)
+        
+        yield {"event": "result", "result": result, "cached": False}
+    
+    def _error_result(self, error: Exception) -> RiskAssessmentResult:
+        """Result returned in place of an assessment that failed"""
+        error_assessments = [
+            RiskAssessment(
+                risk_id="ERROR",
+                risk_title="Assessment Error",
+                risk_description="An error occurred during risk assessment",
+                explanation=f"Error: {str(error)}",
+                controls=[]
+            )
+            for _ in range(config.TOP_N_RISKS)
+        ]
+        return RiskAssessmentResult(risks=error_assessments)
+    
+    async def assess_proposals_batch(self, proposals: List[Union[ProposalSchema, Dict[str, Any]]],
+                                     cfps: Optional[List[Optional[Dict[str, Any]]]] = None,
+                                     use_cache: Optional[List[bool]] = None) -> List[RiskAssessmentResult]:
+        """
+        Assess a batch of proposals concurrently
+        
+        Every proposal starts at once; their Gemini calls queue for the
+        engine's MAX_CONCURRENT_LLM slots. Keyword searches are shared
+        across the batch, proposals that end up with the same candidate
+        risks are ranked together in shared requests, and controls for all
+        candidates are fetched at once.
+        
+        Args:
+            proposals: List of proposal models or dictionaries
+            cfps: Per-proposal CFP context (default: none)
+            use_cache: Per-proposal cache flags (default: use the cache for all)
+            
+        Returns:
+            List of RiskAssessmentResult, in the same order as proposals
+        """
+        if not proposals:
+            return []
+        
+        if cfps is None:
+            cfps = [None] * len(proposals)
+        if use_cache is None:
+            use_cache = [True] * len(proposals)
+        
+        logger.info(f"Assessing batch of {len(proposals)} proposals")
+        
+        batch = _AssessmentBatch(self, len(proposals))
+        try:
+            return await asyncio.gather(*(
+                self._assess_batch_member(batch, proposal, cfp, cache_flag)
+                for proposal, cfp, cache_flag in zip(proposals, cfps, use_cache)
+            ))
+        finally:
+            # Only still dispatching if the batch was cancelled
+            await batch.aclose()
+    
+    async def _assess_batch_member(self, batch: _AssessmentBatch, proposal: Union[ProposalSchema, Dict[str, Any]],
+                                   cfp: Optional[Dict[str, Any]], use_cache: bool) -> RiskAssessmentResult:
+        """Assess one proposal of a batch, sharing its ranking call with the rest"""
+        # Runs in its own task, so the member is only visible to this proposal
+        member = _BatchMember(batch)
+        _batch_member.set(member)
+        try:
+            return await self.assess_proposal(proposal, cfp, use_cache)
+        except asyncio.CancelledError:
+            # Don't let the rest of a cancelled batch go on to call Gemini
+            batch.cancelled = True
+            raise
+        finally:
+            member.leave()
+    
+    async def _search_risks(self, keywords: List[str]) -> List:
+        """Stage 2 search, sharing keyword searches with the rest of the batch when assessed via assess_proposals_batch"""
+        member = _batch_member.get()
+        if member is not None:
+            return await member.batch.search_risks(keywords)
+        return await self.db_client.search_risks(keywords)
+    
+    def _start_control_prefetch(self, candidate_risks: List) -> "asyncio.Task[Optional[Dict[str, List[Control]]]]":
+        """Start fetching controls for the candidates, batch-wide when assessed via assess_proposals_batch"""
+        member = _batch_member.get()
+        if member is not None:
+            return asyncio.create_task(member.batch.prefetch_controls())
+        return asyncio.create_task(self._prefetch_controls(candidate_risks))
+    
+    async def _ranked_risks(self, proposal_text: str, candidate_risks: List,
+                            use_cache: bool) -> AsyncIterator[Dict[str, str]]:
+        """
+        Stage 3 ranked risks, in rank order
+        
+        Streamed from Gemini one risk at a time for a single assessment.
+        Under assess_proposals_batch the ranking is shared with the rest of
+        the batch, so its risks arrive together.
+        """
+        member = _batch_member.get()
+        if member is not None:
+            # The batch takes LLM slots itself when it dispatches; holding
+            # one while waiting for the rest of the batch could deadlock
+            ranking_result = await member.rank(proposal_text, candidate_risks, use_cache)
+            for ranked_risk in ranking_result.risks:
+                yield ranked_risk
+            return
+        
+        async for ranked_risk in self.llm_service.rank_and_select_stream(
+            proposal_text, candidate_risks, use_cache, slots=self._llm_slots
+        ):
+            yield ranked_risk
+    
+    async def _call_llm(self, coro):
+        """Await an LLM call once one of the MAX_CONCURRENT_LLM slots is free"""
+        async with self._llm_slots:
+            return await coro
+    
+    def _as_proposal(self, proposal: Union[ProposalSchema, Dict[str, Any]]) -> ProposalSchema:
+        """Accept plain dictionaries from callers that haven't validated their input"""
+        if isinstance(proposal, ProposalSchema):
+            return proposal
+        return ProposalSchema.model_validate(proposal)
+    
+    def _cache_params(self, proposal: ProposalSchema, cfp: Optional[Dict[str, Any]]):
+        """Namespace and exact key for a proposal"""
+        namespace = f"assessment:{proposal.cfp_id or 'none'}"
+        key = fingerprint([proposal.model_dump_json(exclude_none=True), cfp])
+        return namespace, key
+    
+    async def _get_cached_result(self, proposal: ProposalSchema,
+                                 cfp: Optional[Dict[str, Any]]) -> Optional[RiskAssessmentResult]:
+        """Return a cached result with a fresh assessment ID and timestamp"""
+        try:
+            namespace, key = self._cache_params(proposal, cfp)
+            payload = await self.cache.aget(namespace, key)
+            if payload is None:
+                return None
+            
+            cached = RiskAssessmentResult.model_validate_json(payload)
+            return RiskAssessmentResult(risks=cached.risks)
+        except Exception as e:
+            logger.warning(f"Cache lookup failed: {e}")
+            return None
     
-    def _get_fallback_risks(self) -> List:
+    async def _cache_result(self, proposal: ProposalSchema, cfp: Optional[Dict[str, Any]],
+                            result: RiskAssessmentResult):
+        """Store a successful result in the cache"""
+        if any(risk.risk_id in ("ERROR", "N/A") for risk in result.risks):
+            return
+        
+        try:
+            namespace, key = self._cache_params(proposal, cfp)
+            await self.cache.aset(namespace, key, result.model_dump_json())
+        except Exception as e:
+            logger.warning(f"Cache store failed: {e}")
+    
+    async def _prefetch_controls(self, candidate_risks: List) -> Optional[Dict[str, List[Control]]]:
+        """
+        Fetch controls for every candidate the LLM may rank
+        
+        Runs alongside Stage 3 so the DB round-trip is hidden behind the LLM
+        call. Returns None on failure; Stage 4 then fetches the ranked risks
+        directly.
+        """
+        try:
+            candidate_ids = [r.risk_id for r in candidate_risks[:config.MAX_CANDIDATE_RISKS]]
+            return await self.db_client.get_controls_for_risks(candidate_ids)
+        except Exception as e:
+            logger.warning(f"Control prefetch failed, fetching after ranking instead: {e}")
+            return None
+    
+    async def _controls_for(self, risk_id: str,
+                            controls_task: "asyncio.Task[Optional[Dict[str, List[Control]]]]") -> List[Control]:
+        """Controls for a ranked risk, from the prefetch unless it failed or missed the risk"""
+        prefetched_controls = await controls_task
+        if prefetched_controls is not None and risk_id in prefetched_controls:
+            return prefetched_controls[risk_id]
+        
+        controls_by_risk = await self.db_client.get_controls_for_risks([risk_id])
+        return controls_by_risk.get(risk_id, [])
+    
+    async def _get_fallback_risks(self) -> List:
         """Get fallback risks when keyword search fails"""
         try:
             # Try to get some general risks from the database
             fallback_keywords = ["data", "model", "security", "privacy", "governance"]
-            return self.db_client.search_risks(fallback_keywords)
+            return await self.db_client.search_risks(fallback_keywords)
         except Exception as e:
             logger.error(f"Fallback risk search failed: {e}")
             # Return empty list - will be handled by caller
             return []
     
-    def health_check(self) -> Dict[str, bool]:
+    async def health_check(self) -> Dict[str, bool]:
         """Check health of all dependencies"""
+        database_ok, llm_ok = await asyncio.gather(
+            self.db_client.health_check(),
+            self.llm_service.health_check_async()
+        )
         return {
-            "database_service": self.db_client.health_check(),
-            "llm_service": self.llm_service.health_check()
+            "database_service": database_ok,
+            "llm_service": llm_ok
         }
+    
+    async def warmup(self):
+        """Prime the database connection pool ahead of a run of assessments"""
+        await self.db_client.health_check()
+    
+    async def aclose(self):
+        """Release network resources held by the engine's clients"""
+        await self.db_client.aclose()
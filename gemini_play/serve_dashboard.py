@@ -5,7 +5,6 @@ Serves the HTML file and handles CORS for API calls
 """
 
 import http.server
-import socketserver
 import webbrowser
 import os
 from urllib.parse import urlparse, parse_qs
@@ -27,7 +26,9 @@ def main():
     # Change to the directory containing dashboard.html
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
     
-    with socketserver.TCPServer(("", PORT), CORSRequestHandler) as httpd:
+    # Threaded so the page and its assets load in parallel (daemon threads,
+    # address reuse on restart)
+    with http.server.ThreadingHTTPServer(("", PORT), CORSRequestHandler) as httpd:
         print(f"🚀 Dashboard server running at http://localhost:{PORT}")
         print(f"📊 Open http://localhost:{PORT}/dashboard.html in your browser")
         print("🛑 Press Ctrl+C to stop the server")
@@ -1,219 +1,357 @@
 #!/usr/bin/env python3
 # Simple Test Script for Risk Assessment Engine
 
+import asyncio
+import io
+import multiprocessing
 import os
-import json
+import orjson
 import sys
+from types import MappingProxyType
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from typing import Optional
 
 # Add current directory to path for imports
 sys.path.insert(0, '.')
 
-from risk_engine import RiskAssessmentEngine
-from db_service import DatabaseServiceClient
-from llm_service import GeminiLLMService
+from event_loop import new_event_loop
+
+# Engine modules (and the Gemini SDK behind them) are imported where first
+# used, after main() has loaded .env, so startup stays fast
+
+SAMPLE_DIR = Path("sample_proposals")
+
+# Shared event loop so async HTTP clients stay bound to one loop across tests
+_loop = new_event_loop()
+
+def run(coro):
+    """Run a coroutine on the shared test event loop"""
+    return _loop.run_until_complete(coro)
+
+# Output buffer of the test running in the current task
+_test_output: ContextVar[Optional[io.StringIO]] = ContextVar("test_output", default=None)
+
+class _TestStdout:
+    """sys.stdout stand-in that keeps each concurrently running test's prints together"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+    
+    def write(self, text):
+        return (_test_output.get() or self.stream).write(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def __getattr__(self, name):
+        # Everything else (isatty, encoding, fileno, ...) is the real stream's
+        return getattr(self.stream, name)
+
+@dataclass(slots=True)
+class MockRisk:
+    """Stand-in for models.Risk returned by MockDBClient"""
+    risk_id: str
+    risk_title: str
+    risk_description: str
+
+# Constant data served by MockDBClient, built once
+_MOCK_RISKS = (
+    MockRisk('R.AIR.001', 'Data poisoning (targeted)', 'Attackers manipulate training data'),
+    MockRisk('R.AIR.002', 'Data poisoning (backdoor)', 'Adversaries insert backdoor triggers'),
+    MockRisk('R.AIR.003', 'Data poisoning (indiscriminate)', 'Attackers manipulate large portions of data')
+)
+
+@lru_cache(maxsize=1)
+def mock_controls() -> MappingProxyType:
+    """Controls served by MockDBClient, built on first use and read-only after"""
+    from models import Control
+    
+    return MappingProxyType({
+        'R.AIR.001': (
+            Control(
+                control_id='C.AIIM.1',
+                control_title='Maintain ML-Asset Inventory',
+                control_description='Establish inventory of models'
+            ),
+        ),
+        'R.AIR.002': (
+            Control(
+                control_id='C.AIIM.2',
+                control_title='Automated Discovery',
+                control_description='Deploy discovery tooling'
+            ),
+        ),
+        'R.AIR.003': (
+            Control(
+                control_id='C.AIIM.3',
+                control_title='Track Version & Lineage',
+                control_description='Record hash and version'
+            ),
+        )
+    })
+
+@lru_cache(maxsize=1)
+def get_llm_service() -> "GeminiLLMService":
+    """
+    Gemini service shared by the tests, with its stage cache off
+    
+    Caching is off throughout the tests so results from one engine (mock
+    database, earlier runs) can't stand in for another's real assessment.
+    """
+    from llm_service import GeminiLLMService
+    return GeminiLLMService(cache=False)
 
-def test_basic_functionality():
+@lru_cache(maxsize=1)
+def get_engine() -> "RiskAssessmentEngine":
+    """Create the engine once so tests share its clients and connection pools"""
+    from risk_engine import RiskAssessmentEngine
+    from db_service import DatabaseServiceClient
+    
+    db_client = DatabaseServiceClient()
+    return RiskAssessmentEngine(db_client, get_llm_service(), cache=False)
+
+def print_risks(result):
+    """Print an assessment's risks and their control counts in one write"""
+    sys.stdout.write("".join(
+        f"    {i}. {risk.risk_id}: {risk.risk_title}\n       Controls: {len(risk.controls)}\n"
+        for i, risk in enumerate(result.risks, 1)
+    ))
+
+async def test_basic_functionality():
     """Test basic functionality with mock data"""
     print("Testing Risk Assessment Engine...")
     
-    # Check environment
-    if not os.getenv('GEMINI_API_KEY'):
-        print("❌ GEMINI_API_KEY not set")
-        return False
+    # Initialize services
+    print("  Initializing services...")
+    engine = get_engine()
     
-    try:
-        # Initialize services
-        print("  Initializing services...")
-        db_client = DatabaseServiceClient()
-        llm_service = GeminiLLMService()
-        engine = RiskAssessmentEngine(db_client, llm_service)
-        
-        # Health check
-        print("  Checking health...")
-        health = engine.health_check()
-        print(f"    Database service: {'✓' if health['database_service'] else '✗'}")
-        print(f"    LLM service: {'✓' if health['llm_service'] else '✗'}")
-        
-        if not health['database_service']:
-            print("❌ Database service not available - using local SQLite")
-            # For testing, we'll use a mock approach
-            return test_with_mock_data()
-        
-        # Test with sample proposal
-        print("  Testing with sample proposal...")
-        sample_proposal = {
-            "proposal_title": "Test Proposal",
-            "description": "We want to build a customer support chatbot using AI to answer questions.",
-            "technical_approach": "Use GPT-4 with RAG on our documentation",
-            "data_sources": ["customer_tickets", "product_docs"]
-        }
-        
-        result = engine.assess_proposal(sample_proposal)
-        
-        print(f"    Assessment ID: {result.assessment_id}")
-        print(f"    Risks identified: {len(result.risks)}")
-        
-        for i, risk in enumerate(result.risks, 1):
-            print(f"    {i}. {risk.risk_id}: {risk.risk_title}")
-            print(f"       Controls: {len(risk.controls)}")
-        
-        print("✓ Basic functionality test passed")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Test failed: {e}")
-        return False
+    # Health check
+    print("  Checking health...")
+    health = await engine.health_check()
+    print(f"    Database service: {'✓' if health['database_service'] else '✗'}")
+    print(f"    LLM service: {'✓' if health['llm_service'] else '✗'}")
+    
+    if not health['database_service']:
+        print("❌ Database service not available - using local SQLite")
+        # For testing, we'll use a mock approach
+        return await test_with_mock_data()
+    
+    # Test with sample proposal
+    print("  Testing with sample proposal...")
+    sample_proposal = {
+        "proposal_title": "Test Proposal",
+        "description": "We want to build a customer support chatbot using AI to answer questions.",
+        "technical_approach": "Use GPT-4 with RAG on our documentation",
+        "data_sources": ["customer_tickets", "product_docs"]
+    }
+    
+    result = await engine.assess_proposal(sample_proposal)
+    
+    print(f"    Assessment ID: {result.assessment_id}")
+    print(f"    Risks identified: {len(result.risks)}")
+    
+    print_risks(result)
+    
+    print("✓ Basic functionality test passed")
+    return True
 
-def test_with_mock_data():
+async def test_with_mock_data():
     """Test with mock data when database service is not available"""
     print("  Testing with mock data...")
     
-    try:
-        # Create a mock database client
-        class MockDBClient:
-            def search_risks(self, keywords):
-                # Return mock risks
-                return [
-                    type('Risk', (), {
-                        'risk_id': 'R.AIR.001',
-                        'risk_title': 'Data poisoning (targeted)',
-                        'risk_description': 'Attackers manipulate training data'
-                    })(),
-                    type('Risk', (), {
-                        'risk_id': 'R.AIR.002', 
-                        'risk_title': 'Data poisoning (backdoor)',
-                        'risk_description': 'Adversaries insert backdoor triggers'
-                    })(),
-                    type('Risk', (), {
-                        'risk_id': 'R.AIR.003',
-                        'risk_title': 'Data poisoning (indiscriminate)',
-                        'risk_description': 'Attackers manipulate large portions of data'
-                    })()
-                ]
-            
-            def get_controls_for_risks(self, risk_ids):
-                from models import Control
-                return {
-                    'R.AIR.001': [
-                        Control(
-                            control_id='C.AIIM.1',
-                            control_title='Maintain ML-Asset Inventory',
-                            control_description='Establish inventory of models'
-                        )
-                    ],
-                    'R.AIR.002': [
-                        Control(
-                            control_id='C.AIIM.2',
-                            control_title='Automated Discovery',
-                            control_description='Deploy discovery tooling'
-                        )
-                    ],
-                    'R.AIR.003': [
-                        Control(
-                            control_id='C.AIIM.3',
-                            control_title='Track Version & Lineage',
-                            control_description='Record hash and version'
-                        )
-                    ]
-                }
-            
-            def health_check(self):
-                return True
-        
-        # Initialize with mock
-        db_client = MockDBClient()
-        llm_service = GeminiLLMService()
-        engine = RiskAssessmentEngine(db_client, llm_service)
-        
-        # Test proposal
-        sample_proposal = {
-            "proposal_title": "Test Proposal",
-            "description": "We want to build a customer support chatbot using AI to answer questions.",
-            "technical_approach": "Use GPT-4 with RAG on our documentation"
-        }
-        
-        result = engine.assess_proposal(sample_proposal)
-        
-        print(f"    Assessment ID: {result.assessment_id}")
-        print(f"    Risks identified: {len(result.risks)}")
+    # Create a mock database client
+    class MockDBClient:
+        async def search_risks(self, keywords):
+            return list(_MOCK_RISKS)
         
-        for i, risk in enumerate(result.risks, 1):
-            print(f"    {i}. {risk.risk_id}: {risk.risk_title}")
-            print(f"       Controls: {len(risk.controls)}")
+        async def get_controls_for_risks(self, risk_ids):
+            controls = mock_controls()
+            return {rid: controls[rid] for rid in risk_ids if rid in controls}
         
-        print("✓ Mock data test passed")
-        return True
+        async def health_check(self):
+            return True
         
-    except Exception as e:
-        print(f"❌ Mock test failed: {e}")
-        return False
+        async def aclose(self):
+            pass
+    
+    # Initialize with mock
+    from risk_engine import RiskAssessmentEngine
+    
+    db_client = MockDBClient()
+    engine = RiskAssessmentEngine(db_client, get_llm_service(), cache=False)
+    
+    # Test proposal
+    sample_proposal = {
+        "proposal_title": "Test Proposal",
+        "description": "We want to build a customer support chatbot using AI to answer questions.",
+        "technical_approach": "Use GPT-4 with RAG on our documentation"
+    }
+    
+    result = await engine.assess_proposal(sample_proposal)
+    
+    print(f"    Assessment ID: {result.assessment_id}")
+    print(f"    Risks identified: {len(result.risks)}")
+    
+    print_risks(result)
+    
+    print("✓ Mock data test passed")
+    return True
+
+@lru_cache(maxsize=1)
+def sample_proposal_files() -> tuple:
+    """JSON files in SAMPLE_DIR, listed once per run"""
+    # scandir entries carry their file type, so is_file() needs no extra stat
+    with os.scandir(SAMPLE_DIR) as entries:
+        return tuple(Path(entry.path) for entry in entries if entry.name.endswith(".json") and entry.is_file())
+
+def assess_batch_in_worker(proposals):
+    """Process pool task: assess proposals with this worker's engine, returning their risk IDs"""
+    results = run(get_engine().assess_proposals_batch(proposals))
+    return [[r.risk_id for r in result.risks] for result in results]
 
-def test_sample_proposals():
+async def assess_in_processes(proposals, processes):
+    """
+    Split proposals across worker processes, each with its own engine and Gemini client
+    
+    Workers are spawned rather than forked, as the parent's event loop is
+    running, and build their engine up front. Risk IDs are returned in
+    the same order as proposals.
+    """
+    size = -(-len(proposals) // processes)
+    chunks = [proposals[i:i + size] for i in range(0, len(proposals), size)]
+    
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=len(chunks), mp_context=multiprocessing.get_context("spawn"),
+                             initializer=get_engine) as pool:
+        chunk_results = await asyncio.gather(*(
+            loop.run_in_executor(pool, assess_batch_in_worker, chunk) for chunk in chunks
+        ))
+    
+    return [risk_ids for chunk_result in chunk_results for risk_ids in chunk_result]
+
+async def assess_proposal_files(engine, proposal_files, processes=1):
+    """
+    Assess the sample proposal files as one batch
+    
+    The engine shares keyword searches, ranking requests and the control
+    lookup across the batch. With processes > 1 the batch is split across
+    that many worker processes instead. Files with identical content are
+    assessed once. Results are returned in the same order as proposal_files.
+    """
+    from cache import fingerprint
+    
+    unique_proposals = {}
+    proposal_keys = []
+    for proposal_file in proposal_files:
+        print(f"  Testing: {proposal_file.name}")
+        proposal_data = orjson.loads(proposal_file.read_bytes())
+        key = fingerprint(proposal_data)
+        unique_proposals.setdefault(key, proposal_data)
+        proposal_keys.append(key)
+    
+    proposals = list(unique_proposals.values())
+    if processes > 1:
+        risk_ids = await assess_in_processes(proposals, processes)
+    else:
+        results = await engine.assess_proposals_batch(proposals)
+        risk_ids = [[r.risk_id for r in result.risks] for result in results]
+    
+    risk_ids_by_key = dict(zip(unique_proposals, risk_ids))
+    return [
+        {
+            'file': proposal_file.name,
+            'risks_count': len(risk_ids_by_key[key]),
+            'risk_ids': risk_ids_by_key[key]
+        }
+        for proposal_file, key in zip(proposal_files, proposal_keys)
+    ]
+
+async def test_sample_proposals():
     """Test with sample proposal files"""
     print("\nTesting with sample proposals...")
     
-    sample_dir = Path("sample_proposals")
-    if not sample_dir.exists():
+    if not SAMPLE_DIR.exists():
         print("❌ Sample proposals directory not found")
         return False
     
-    proposal_files = list(sample_dir.glob("*.json"))
+    proposal_files = sample_proposal_files()
     if not proposal_files:
         print("❌ No sample proposal files found")
         return False
     
+    # Initialize services
+    engine = get_engine()
+    
+    # Opt-in: spread large sample sets across worker processes
+    processes = int(os.environ.get('TEST_PROCESSES', '1'))
+    results = await assess_proposal_files(engine, proposal_files, processes)
+    
+    # Summary
+    print("\n  Test Results:")
+    sys.stdout.write("".join(f"    {result['file']}: {result['risks_count']} risks\n" for result in results))
+    
+    print("✓ Sample proposals test passed")
+    return True
+
+async def run_test(test):
+    """
+    Run one test in its own task, returning whether it passed and what it printed
+    
+    A test that raises counts as failed; with PYTHONDEBUG set the exception
+    propagates instead, so debuggers and profilers see where it came from.
+    """
+    output = io.StringIO()
+    _test_output.set(output)
     try:
-        # Initialize services
-        db_client = DatabaseServiceClient()
-        llm_service = GeminiLLMService()
-        engine = RiskAssessmentEngine(db_client, llm_service)
-        
-        results = []
-        for proposal_file in proposal_files:
-            print(f"  Testing: {proposal_file.name}")
-            
-            with open(proposal_file, 'r') as f:
-                proposal_data = json.load(f)
-            
-            result = engine.assess_proposal(proposal_data)
-            results.append({
-                'file': proposal_file.name,
-                'risks_count': len(result.risks),
-                'risk_ids': [r.risk_id for r in result.risks]
-            })
-        
-        # Summary
-        print("\n  Test Results:")
-        for result in results:
-            print(f"    {result['file']}: {result['risks_count']} risks")
-        
-        print("✓ Sample proposals test passed")
-        return True
-        
+        passed = await test()
     except Exception as e:
-        print(f"❌ Sample proposals test failed: {e}")
-        return False
+        if os.environ.get('PYTHONDEBUG'):
+            raise
+        print(f"❌ {test.__name__} failed: {e}")
+        passed = False
+    return passed, output.getvalue()
+
+async def run_tests(tests):
+    """Run tests concurrently, returning (passed, output) for each in order"""
+    return await asyncio.gather(*(run_test(test) for test in tests))
 
 def main():
     """Run all tests"""
+    # Load environment variables from .env file
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     print("Risk Assessment Engine Test Suite")
     print("=" * 50)
     
+    # Every test calls Gemini, so check for a key once up front
+    if not os.environ.get('GEMINI_API_KEY'):
+        print("❌ GEMINI_API_KEY not set")
+        return 1
+    
     tests = [
         test_basic_functionality,
         test_sample_proposals
     ]
     
+    # The tests wait on Gemini and the database, so run them concurrently
+    stdout = sys.stdout
+    sys.stdout = _TestStdout(stdout)
+    try:
+        outcomes = run(run_tests(tests))
+    finally:
+        sys.stdout = stdout
+    
     passed = 0
     total = len(tests)
     
-    for test in tests:
-        if test():
+    for test_passed, output in outcomes:
+        sys.stdout.write(output)
+        if test_passed:
             passed += 1
         print()
     
@@ -0,0 +1,151 @@
+# LLM Service Tests
+#
+# Incremental parsing of streamed rankings, and rank_and_select_stream
+# against a stubbed Gemini model, so they run offline.
+# Run from this directory with: python -m unittest test_llm_service
+
+import asyncio
+import json
+import unittest
+
+from models import Risk
+from llm_service import GeminiLLMService, _RankedRiskParser
+
+RISKS = [
+    Risk(risk_id=f"R.AIR.00{i}", risk_title=f"Risk {i}", risk_description=f"Description of risk {i}")
+    for i in range(1, 6)
+]
+
+RANKING = json.dumps({"risks": [
+    {"risk_id": "R.AIR.002", "reasoning": "Handles personal data, {braces} and \"quotes\"."},
+    {"risk_id": "R.AIR.004", "reasoning": "Model output is shown to users."},
+    {"risk_id": "R.AIR.001", "reasoning": "Applies to this proposal."},
+]})
+
+def feed_all(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+class RankedRiskParserTests(unittest.TestCase):
+    
+    def test_whole_response(self):
+        items = _RankedRiskParser().feed(RANKING)
+        
+        self.assertEqual(items, json.loads(RANKING)["risks"])
+    
+    def test_objects_split_across_chunks(self):
+        for size in (1, 3, 7, 40):
+            with self.subTest(size=size):
+                parser = _RankedRiskParser()
+                self.assertEqual(feed_all(parser, split(RANKING, size)), json.loads(RANKING)["risks"])
+    
+    def test_item_returned_once_complete(self):
+        parser = _RankedRiskParser()
+        first_end = RANKING.index("},") + 1
+        
+        self.assertEqual(parser.feed(RANKING[:first_end - 1]), [])
+        self.assertEqual([item["risk_id"] for item in parser.feed(RANKING[first_end - 1:first_end])], ["R.AIR.002"])
+    
+    def test_array_opening_split_across_chunks(self):
+        parser = _RankedRiskParser()
+        
+        self.assertEqual(parser.feed('{"ri'), [])
+        self.assertEqual(parser.feed('sks" :'), [])
+        self.assertIsNone(parser.pos)
+        self.assertEqual(parser.feed(' [{"risk_id": "R.AIR.001", "reasoning": "x"}'),
+                         [{"risk_id": "R.AIR.001", "reasoning": "x"}])
+    
+    def test_trailing_garbage_ignored(self):
+        parser = _RankedRiskParser()
+        
+        items = feed_all(parser, [RANKING, "\n```\nsome trailing text {\"risk_id\": \"R.AIR.005\"}"])
+        
+        self.assertEqual([item["risk_id"] for item in items], ["R.AIR.002", "R.AIR.004", "R.AIR.001"])
+    
+    def test_garbage_inside_array_stops_parsing(self):
+        parser = _RankedRiskParser()
+        
+        items = parser.feed('{"risks": [{"risk_id": "R.AIR.001", "reasoning": "x"}, oops {"risk_id": "R.AIR.002"}]}')
+        
+        self.assertEqual(items, [{"risk_id": "R.AIR.001", "reasoning": "x"}])
+
+class FakeChunk:
+    """A streamed response chunk; text=None behaves like a chunk with no text part"""
+    
+    def __init__(self, text):
+        self._text = text
+    
+    @property
+    def text(self):
+        if self._text is None:
+            raise ValueError("The `response.text` quick accessor requires a single candidate")
+        return self._text
+
+class FakeStream:
+    """Yields each chunk on its own event loop turn"""
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+    
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            yield FakeChunk(chunk)
+
+class FakeModel:
+    """Streams a fixed response in chunks"""
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+    
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        return FakeStream(self.chunks)
+
+def make_service(chunks):
+    service = GeminiLLMService(api_key="test", cache=False)
+    service.model = FakeModel(chunks)
+    return service
+
+class RankStreamTests(unittest.IsolatedAsyncioTestCase):
+    
+    async def test_yields_ranked_risks(self):
+        service = make_service(split(RANKING, 16) + [None])
+        
+        ranked = [item async for item in service.rank_and_select_stream("A proposal", RISKS, use_cache=False)]
+        
+        self.assertEqual([item["risk_id"] for item in ranked], ["R.AIR.002", "R.AIR.004", "R.AIR.001"])
+    
+    async def test_chunk_without_text_skipped(self):
+        service = make_service([None, RANKING[:50], None, RANKING[50:]])
+        
+        ranked = [item async for item in service.rank_and_select_stream("A proposal", RISKS, use_cache=False)]
+        
+        self.assertEqual(len(ranked), 3)
+    
+    async def test_unknown_risk_id_rejected(self):
+        service = make_service([RANKING.replace("R.AIR.004", "R.AIR.999")])
+        
+        with self.assertRaises(ValueError):
+            async for _ in service.rank_and_select_stream("A proposal", RISKS, use_cache=False):
+                pass
+    
+    async def test_slot_released_while_consumer_is_slow(self):
+        service = make_service(split(RANKING, 16))
+        slots = asyncio.Semaphore(1)
+        
+        stream = service.rank_and_select_stream("A proposal", RISKS, use_cache=False, slots=slots)
+        first = await anext(stream)
+        # The response is fully read while the consumer sits on the first risk
+        await asyncio.sleep(0.05)
+        
+        self.assertEqual(first["risk_id"], "R.AIR.002")
+        self.assertFalse(slots.locked())
+        self.assertEqual(len([item async for item in stream]), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+# Risk Engine Batch Tests
+#
+# Drive assess_proposals_batch against a stubbed Gemini model and database
+# client, so the batch coordinator runs deterministically and offline.
+# Run from this directory with: python -m unittest test_risk_engine
+
+import asyncio
+import json
+import re
+import unittest
+
+from models import Risk, Control
+from llm_service import GeminiLLMService
+from risk_engine import RiskAssessmentEngine
+
+RISKS = [
+    Risk(risk_id=f"R.AIR.00{i}", risk_title=f"Risk {i}", risk_description=f"Description of risk {i}")
+    for i in range(1, 6)
+]
+
+_CANDIDATE_ID_RE = re.compile(r'^ID: (\S+)$', re.MULTILINE)
+_PROPOSAL_ID_RE = re.compile(r'^PROPOSAL ID: (P\d+)$', re.MULTILINE)
+
+class FakeResponse:
+    """Stands in for a non-streamed Gemini response"""
+    
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeModel:
+    """
+    Answers keyword, ranking and batch ranking prompts like Gemini would
+    
+    batch_response picks how multi-proposal prompts are answered: "ok",
+    "malformed" (not JSON) or "short" (one proposal missing). A proposal
+    containing "slow" has its keyword extraction wait for release.
+    """
+    
+    def __init__(self, batch_response: str = "ok"):
+        self.batch_response = batch_response
+        self.calls = []
+        self.release = asyncio.Event()
+    
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        await asyncio.sleep(0)
+        
+        if "CANDIDATE RISKS:" not in prompt:
+            self.calls.append("keywords")
+            if "slow" in prompt:
+                await self.release.wait()
+            return FakeResponse(json.dumps({"keywords": ["privacy", "model"], "confidence": 0.9}))
+        
+        candidate_block = prompt.split("CANDIDATE RISKS:", 1)[1]
+        ranked = [
+            {"risk_id": risk_id, "reasoning": "Applies to this proposal."}
+            for risk_id in _CANDIDATE_ID_RE.findall(candidate_block)[:3]
+        ]
+        
+        proposal_ids = _PROPOSAL_ID_RE.findall(prompt)
+        if not proposal_ids:
+            self.calls.append("rank")
+            return FakeResponse(json.dumps({"risks": ranked}))
+        
+        self.calls.append(f"batch:{len(proposal_ids)}")
+        if self.batch_response == "malformed":
+            return FakeResponse('{"results": [')
+        if self.batch_response == "short":
+            proposal_ids = proposal_ids[:-1]
+        return FakeResponse(json.dumps({
+            "results": [{"proposal_id": pid, "risks": ranked} for pid in proposal_ids]
+        }))
+
+class FakeDBClient:
+    """Returns the same candidate risks for every keyword, counting searches"""
+    
+    def __init__(self):
+        self.searches = []
+        self.control_fetches = 0
+    
+    async def search_risks(self, keywords):
+        self.searches.extend(keywords)
+        await asyncio.sleep(0)
+        return list(RISKS)
+    
+    async def get_controls_for_risks(self, risk_ids):
+        self.control_fetches += 1
+        return {
+            risk_id: [Control(control_id=f"C.{risk_id}", control_title=f"Control for {risk_id}")]
+            for risk_id in risk_ids
+        }
+    
+    async def health_check(self):
+        return True
+    
+    async def aclose(self):
+        pass
+
+def make_engine(batch_response: str = "ok"):
+    """Engine wired to fakes, with every cache off"""
+    llm_service = GeminiLLMService(api_key="test", cache=False)
+    llm_service.model = FakeModel(batch_response)
+    db_client = FakeDBClient()
+    engine = RiskAssessmentEngine(db_client, llm_service, cache=False)
+    return engine, llm_service.model, db_client
+
+def risk_ids(result):
+    return [risk.risk_id for risk in result.risks]
+
+class AssessmentBatchTests(unittest.IsolatedAsyncioTestCase):
+    
+    async def test_invalid_proposal_fails_alone(self):
+        engine, model, _ = make_engine()
+        
+        results = await engine.assess_proposals_batch([
+            {"description": "Chatbot over support tickets"},
+            {"proposal_title": "No description"},
+            {"description": "Fraud detection", "data_sources": "card transactions"},
+        ])
+        
+        self.assertEqual(risk_ids(results[0]), ["R.AIR.001", "R.AIR.002", "R.AIR.003"])
+        self.assertEqual(risk_ids(results[1]), ["ERROR"] * 3)
+        self.assertEqual(risk_ids(results[2]), ["R.AIR.001", "R.AIR.002", "R.AIR.003"])
+        # The two valid proposals share candidates, so they're ranked together
+        self.assertEqual(model.calls.count("batch:2"), 1)
+        self.assertNotIn("rank", model.calls)
+    
+    async def test_duplicate_proposals_share_searches(self):
+        engine, model, db_client = make_engine()
+        proposal = {"description": "Chatbot over support tickets"}
+        
+        results = await engine.assess_proposals_batch([proposal, dict(proposal), proposal])
+        
+        for result in results:
+            self.assertEqual(risk_ids(result), ["R.AIR.001", "R.AIR.002", "R.AIR.003"])
+            self.assertEqual(result.risks[0].controls[0].control_id, "C.R.AIR.001")
+        # Each keyword is searched once and controls fetched once for the batch
+        self.assertEqual(sorted(db_client.searches), ["model", "privacy"])
+        self.assertEqual(db_client.control_fetches, 1)
+        self.assertEqual(model.calls, ["keywords"] * 3 + ["batch:3"])
+    
+    async def test_malformed_batch_response_falls_back(self):
+        engine, model, _ = make_engine("malformed")
+        
+        results = await engine.assess_proposals_batch([
+            {"description": "Chatbot over support tickets"},
+            {"description": "Fraud detection"},
+        ])
+        
+        for result in results:
+            self.assertEqual(risk_ids(result), ["R.AIR.001", "R.AIR.002", "R.AIR.003"])
+        self.assertEqual(model.calls.count("batch:2"), 1)
+        self.assertEqual(model.calls.count("rank"), 2)
+    
+    async def test_short_batch_response_falls_back(self):
+        engine, model, _ = make_engine("short")
+        
+        results = await engine.assess_proposals_batch([
+            {"description": "Chatbot over support tickets"},
+            {"description": "Fraud detection"},
+            {"description": "Document summarizer"},
+        ])
+        
+        for result in results:
+            self.assertEqual(risk_ids(result), ["R.AIR.001", "R.AIR.002", "R.AIR.003"])
+        self.assertEqual(model.calls.count("batch:3"), 1)
+        self.assertEqual(model.calls.count("rank"), 3)
+    
+    async def test_cancelled_batch_dispatches_nothing(self):
+        engine, model, _ = make_engine()
+        
+        batch = asyncio.create_task(engine.assess_proposals_batch([
+            {"description": "Chatbot over support tickets"},
+            {"description": "Fraud detection"},
+            {"description": "A slow one"},
+        ]))
+        # Let the fast proposals submit their rankings while the slow one waits
+        await asyncio.sleep(0.05)
+        self.assertEqual(model.calls, ["keywords"] * 3)
+        
+        batch.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await batch
+        model.release.set()
+        await asyncio.sleep(0.05)
+        
+        self.assertEqual(model.calls, ["keywords"] * 3)
+        self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+
+if __name__ == "__main__":
+    unittest.main()